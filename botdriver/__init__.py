@@ -1,22 +1,228 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import atexit
+import json
+import threading
 import time
+from contextlib import contextmanager
+
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.webdriver.support.ui import WebDriverWait
 
 import config
 import constants
+from common import deadline
 
 __version__ = "1.0"
 
 
-def get_driver():
+# lean模式下屏蔽的静态资源
+_static_pattern = r'\.(png|jpe?g|gif|webp|ico|svg|css|woff2?|ttf|eot|mp3|mp4)(\?|$)'
+
+# PhantomJS中运行，this是当前页面，%s依次是允许的host和静态资源的正则
+_phantom_block_script = """
+var hosts = %s, staticPattern = new RegExp(%s, 'i');
+this.onResourceRequested = function (requestData, networkRequest) {
+    var host = requestData.url.split('/')[2] || '';
+    if (hosts.indexOf(host) < 0 || staticPattern.test(requestData.url)) {
+        networkRequest.abort();
+    }
+};
+"""
+
+
+def get_driver(lean=False):
+    """
+
+    :param lean: 为True时不加载图片，屏蔽config.browser_allowed_hosts以外的请求，PhantomJS还会屏蔽样式表和字体等静态资源。
+        只读取page_source时使用，需要截图的验证码页面不能使用
+    """
     if config.browser_platform == constants.chrome:
-        return webdriver.Chrome(executable_path=config.chrome_path,
-                                service_log_path=config.log_path + time.strftime("%Y-%m-%d") + "_chrome.log")
+        options = webdriver.ChromeOptions()
+        if lean:
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+            # 其他host解析失败，不会发出请求
+            options.add_argument('--host-resolver-rules=MAP * ~NOTFOUND, %s' % ', '.join(
+                'EXCLUDE %s' % h for h in config.browser_allowed_hosts))
+        driver = webdriver.Chrome(executable_path=config.chrome_path, chrome_options=options,
+                                  service_log_path=config.log_path + time.strftime("%Y-%m-%d") + "_chrome.log")
+        driver.set_page_load_timeout(config.read_timeout)
+        return driver
     elif config.browser_platform == constants.phantomjs:
-        return webdriver.PhantomJS(executable_path=config.phantomjs_path,
-                                   service_log_path=config.log_path + time.strftime("%Y-%m-%d") + "_ghost.log")
+        capabilities = dict(DesiredCapabilities.PHANTOMJS)
+        if lean:
+            capabilities['phantomjs.page.settings.loadImages'] = False
+        driver = webdriver.PhantomJS(executable_path=config.phantomjs_path, desired_capabilities=capabilities,
+                                     service_log_path=config.log_path + time.strftime("%Y-%m-%d") + "_ghost.log")
+        driver.set_page_load_timeout(config.read_timeout)
+        if lean:
+            driver.command_executor._commands['executePhantomScript'] = (
+                'POST', '/session/$sessionId/phantom/execute')
+            script = _phantom_block_script % (json.dumps(list(config.browser_allowed_hosts)),
+                                              json.dumps(_static_pattern))
+            driver.execute('executePhantomScript', {'script': script, 'args': []})
+        return driver
     else:
         print("%s not found" % config.browser_platform)
         raise Exception("%s not found" % config.browser_platform)
+
+
+def quit_driver(driver):
+    """结束浏览器进程，close()只关闭窗口，PhantomJS进程会一直留着
+    """
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+def _has_element(selector):
+    return lambda driver: len(driver.find_elements_by_css_selector(selector)) > 0
+
+
+def _has_text(*texts):
+    return lambda driver: any(t in driver.page_source for t in texts)
+
+
+def _document_complete(driver):
+    return driver.execute_script('return document.readyState') == 'complete'
+
+
+# (url中包含的字符串, 页面可以读取的条件)，按顺序匹配第一个
+# 搜狗搜索页：有结果列表、没有结果或者出现验证码
+# 公众号页：文章列表写在msgList变量中
+# 文章页：有正文或者出现验证码
+_ready_conditions = (
+    ('weixin.sogou.com/weixin', _has_element('.news-list2, .news-list, #noresult_part1_container, '
+                                             '#verify_img, #seccodeImage')),
+    ('mp.weixin.qq.com/profile', _has_text('var msgList', u'请输入验证码')),
+    ('mp.weixin.qq.com/s', _has_text('id="js_content"', u'请输入验证码')),
+)
+
+
+def get_ready_condition(url):
+    for pattern, condition in _ready_conditions:
+        if pattern in url:
+            return condition
+    return _document_complete
+
+
+def wait_until_ready(driver, url, timeout=None):
+    """等待页面可以读取，最多等待config.browser_ready_timeout秒，不超过当前线程的截止时间(见common.deadline)
+
+    :return: 超时返回False，这时仍可以读取当前的page_source
+    """
+    timeout = config.browser_ready_timeout if timeout is None else timeout
+    left = deadline.remaining()
+    if left is not None:
+        timeout = min(timeout, left)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.2).until(get_ready_condition(url))
+        return True
+    except TimeoutException:
+        return False
+
+
+class DriverPool(object):
+    """进程内复用的WebDriver池
+
+    启动一个浏览器要好几秒，用完的driver放回池中给下一个页面使用。借出时检查浏览器是否还能响应，
+    一个driver加载的页面数达到config.browser_max_pages后结束进程，避免浏览器内存不断增长。
+    """
+
+    def __init__(self, size, max_pages, lean=True):
+        self.size = size
+        self.max_pages = max_pages
+        self.lean = lean
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self._idle = list()
+        self._pages = dict()
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.misses += 1
+                    break
+                driver = self._idle.pop()
+            if self._is_alive(driver):
+                with self._lock:
+                    self.hits += 1
+                return driver
+            self.discard(driver)
+        driver = get_driver(lean=self.lean)
+        with self._lock:
+            self._pages[id(driver)] = 0
+        return driver
+
+    def checkin(self, driver):
+        with self._lock:
+            pages = self._pages.get(id(driver), 0) + 1
+            self._pages[id(driver)] = pages
+            if pages < self.max_pages and len(self._idle) < self.size:
+                self._idle.append(driver)
+                return
+            if pages >= self.max_pages:
+                self.recycled += 1
+        self.discard(driver)
+
+    def discard(self, driver):
+        """结束出错的driver，不再放回池中
+        """
+        with self._lock:
+            self._pages.pop(id(driver), None)
+        quit_driver(driver)
+
+    def detach(self, driver):
+        """driver交给调用方管理，例如验证码会话，之后由调用方关闭
+        """
+        with self._lock:
+            self._pages.pop(id(driver), None)
+
+    @contextmanager
+    def driver(self):
+        d = self.checkout()
+        try:
+            yield d
+        except Exception:
+            self.discard(d)
+            raise
+        self.checkin(d)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, list()
+        for driver in idle:
+            self.discard(driver)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'recycled': self.recycled,
+            }
+
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+
+_pool = DriverPool(config.browser_pool_size, config.browser_max_pages, config.browser_lean)
+atexit.register(_pool.close_all)
+
+
+def get_pool():
+    return _pool
@@ -70,3 +70,4 @@ def replace_html(s):
     s = s.replace('&nbsp;', ' ')
     s = s.replace('\\', '')
     return s
+
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""按host和接口类型熔断
+
+搜狗出现"访问过于频繁"页面或者返回5xx时，继续请求只会浪费请求预算、写错误日志，甚至等待验证码。
+最近config.breaker_window次请求中失败的比例达到config.breaker_failure_ratio时熔断，这期间的请求直接抛出异常；
+config.breaker_open_seconds秒后放行一个试探请求，成功则恢复，失败则继续熔断，等待时间加倍。
+
+请求结果由common.rate_control的on_success和on_throttle记录，验证码、429和5xx算作失败。
+"""
+import threading
+import time
+from collections import deque
+
+try:
+    import urlparse as url_parse
+except ImportError:
+    import urllib.parse as url_parse
+
+import config
+from wechatsogou.exceptions import WechatSogouCircuitOpenException
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# {host/路径: 接口类型}，先匹配两级路径再匹配一级路径，不在这里的url不熔断(例如解封验证码的接口)
+_endpoints = {
+    'weixin.sogou.com/weixin': 'search',
+    'weixin.sogou.com/pcindex': 'index',
+    'mp.weixin.qq.com/profile': 'profile',
+    'mp.weixin.qq.com/s': 'article',
+    'mp.weixin.qq.com/mp/getcomment': 'comment',
+    'mp.weixin.qq.com/mp/getrelatedmsg': 'related',
+    'mp.weixin.qq.com/mp/getmasssendmsg': 'history',
+}
+
+
+def get_endpoint(url):
+    """
+
+    :return: host和接口类型，例如weixin.sogou.com/search，不熔断的url返回None
+    """
+    parts = url_parse.urlparse(url)
+    segments = parts.path.strip('/').split('/')
+    for depth in (2, 1):
+        name = _endpoints.get('%s/%s' % (parts.netloc, '/'.join(segments[:depth])))
+        if name:
+            return '%s/%s' % (parts.netloc, name)
+    return None
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._results = deque(maxlen=config.breaker_window)
+        self._opens = 0
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def get_open_seconds(self):
+        """连续熔断时等待时间加倍
+        """
+        return min(config.breaker_max_open_seconds, config.breaker_open_seconds * 2 ** max(0, self._opens - 1))
+
+    def allow(self):
+        """
+
+        :return: 是否可以发出请求，半开状态下同时只放行一个试探请求
+        """
+        now = time.time()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.get_open_seconds():
+                self.state = HALF_OPEN
+                self._probe_at = None
+            if self.state == HALF_OPEN:
+                # 试探请求超时没有结果时可以再放行一个
+                if self._probe_at is None or now - self._probe_at > config.connect_timeout + config.read_timeout:
+                    self._probe_at = now
+                    return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if success:
+                    self.state = CLOSED
+                    self._opens = 0
+                    self._results.clear()
+                else:
+                    self._open()
+                return
+            if self.state == OPEN:
+                # 熔断前已经发出的请求
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= config.breaker_min_requests and \
+                    failures >= config.breaker_failure_ratio * len(self._results):
+                self._open()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failure_ratio': float(self._results.count(False)) / len(self._results) if self._results else 0.0,
+                'requests': len(self._results),
+                'rejected': self.rejected,
+                'retry_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(
+                    self.opened_at + self.get_open_seconds())) if self.state != CLOSED else None,
+            }
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self._opens += 1
+        self._results.clear()
+
+
+_breakers = dict()
+_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """
+
+    :return: url对应的CircuitBreaker，不熔断的url返回None
+    """
+    endpoint = get_endpoint(url)
+    if endpoint is None:
+        return None
+    with _lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def check(url):
+    """请求前调用
+
+    :raise WechatSogouCircuitOpenException: url对应的接口正在熔断
+    """
+    breaker = get_breaker(url)
+    if breaker and not breaker.allow():
+        raise WechatSogouCircuitOpenException('%s circuit open' % breaker.name)
+
+
+def record(url, success):
+    breaker = get_breaker(url)
+    if breaker:
+        breaker.record(success)
+
+
+def get_states():
+    """
+
+    :return: dict {host/接口类型: 状态}，用于/rest/status
+    """
+    with _lock:
+        breakers = list(_breakers.values())
+    return dict((b.name, b.stats()) for b in breakers)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""浏览器和requests会话之间共享cookie
+
+浏览器解决验证码后把解封的cookie保存到这里，requests会话在下一次请求前取用，之后的批量抓取不需要再打开浏览器。
+反过来，用浏览器打开验证码页面之前先写入requests会话的cookie，这样解封的就是requests使用的身份。
+协程引擎(common.coroutine_engine)不使用requests会话，直接用Cookie请求头和Set-Cookie响应头读写这里的cookie。
+cookie按身份(config.cache_session_name，每个worker不同)保存在缓存中，重启后仍然有效。
+"""
+import threading
+import time
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+
+try:
+    from Cookie import CookieError, SimpleCookie
+except ImportError:
+    from http.cookies import CookieError, SimpleCookie
+
+try:
+    import urlparse as url_parse
+except ImportError:
+    import urllib.parse as url_parse
+
+from selenium.common.exceptions import WebDriverException
+
+import config
+from common import rate_limit
+from wechatsogou.filecache import WechatCache
+
+_FIELDS = ('name', 'value', 'domain', 'path', 'expiry', 'secure')
+
+_cache = None
+_store = None
+_lock = threading.Lock()
+
+
+def _get_store():
+    """
+    :return: {'version': 每次保存加1, 'cookies': list of dict}
+    """
+    global _cache, _store
+    if _store is None:
+        _cache = WechatCache(config.cache_dir)
+        _store = _cache.get(_cache_key()) or {'version': 0, 'cookies': []}
+    return _store
+
+
+def _cache_key():
+    return 'cookies_' + config.cache_session_name
+
+
+def _domain_match(host, domain):
+    domain = domain.lstrip('.')
+    return host == domain or host.endswith('.' + domain)
+
+
+def get_cookies():
+    """
+    :return: list of dict 没有过期的cookie，字段同selenium的get_cookies()
+    """
+    now = time.time()
+    with _lock:
+        return [c for c in _get_store()['cookies'] if not c.get('expiry') or c['expiry'] > now]
+
+
+def save_cookies(cookies):
+    """合并保存cookie，domain、path和name相同的覆盖原来的值
+
+    :type cookies: list of dict
+    """
+    global _store
+    with _lock:
+        store = _get_store()
+        merged = OrderedDict(((c['domain'], c['path'], c['name']), c) for c in store['cookies'])
+        for c in cookies:
+            merged[(c['domain'], c['path'], c['name'])] = c
+        _store = {'version': store['version'] + 1, 'cookies': list(merged.values())}
+        _cache.set(_cache_key(), _store, 0)
+
+
+def from_driver(driver):
+    cookies = list()
+    for c in driver.get_cookies():
+        c.setdefault('path', '/')
+        cookies.append(dict((k, c.get(k)) for k in _FIELDS))
+    save_cookies(cookies)
+
+
+def from_session(session):
+    save_cookies([{
+        'name': c.name,
+        'value': c.value,
+        'domain': c.domain,
+        'path': c.path or '/',
+        'expiry': c.expires,
+        'secure': c.secure,
+    } for c in session.cookies])
+
+
+def from_headers(url, set_cookies):
+    """保存url的响应中Set-Cookie头设置的cookie
+
+    :type set_cookies: list of str 每个Set-Cookie头的值
+    """
+    host = rate_limit.get_host(url)
+    cookies = list()
+    for header in set_cookies:
+        jar = SimpleCookie()
+        try:
+            jar.load(header)
+        except CookieError:
+            continue
+        for name, morsel in jar.items():
+            cookies.append({
+                'name': name,
+                'value': morsel.value,
+                'domain': morsel['domain'] or host,
+                'path': morsel['path'] or '/',
+                'expiry': _get_expiry(morsel),
+                'secure': bool(morsel['secure']),
+            })
+    if cookies:
+        save_cookies(cookies)
+
+
+def _get_expiry(morsel):
+    """
+    :return: 过期时间的时间戳，会话cookie返回None
+    """
+    if morsel['max-age']:
+        try:
+            return int(time.time()) + int(morsel['max-age'])
+        except ValueError:
+            return None
+    if morsel['expires']:
+        parsed = parsedate_tz(morsel['expires'])
+        if parsed:
+            return int(mktime_tz(parsed))
+    return None
+
+
+def to_header(url):
+    """
+    :return: 请求url时的Cookie头，没有cookie时返回None
+    """
+    parts = url_parse.urlparse(url)
+    host = rate_limit.get_host(url)
+    path = parts.path or '/'
+    cookies = [c for c in get_cookies() if _domain_match(host, c['domain']) and path.startswith(c['path'])
+               and (parts.scheme == 'https' or not c.get('secure'))]
+    if not cookies:
+        return None
+    return '; '.join('%s=%s' % (c['name'], c['value']) for c in cookies)
+
+
+def to_session(session):
+    """把共享的cookie写入requests会话，会话已经是最新的时候什么都不做
+    """
+    with _lock:
+        version = _get_store()['version']
+    if getattr(session, '_cookie_bridge_version', None) == version:
+        return
+    for c in get_cookies():
+        session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                            expires=c.get('expiry'), secure=bool(c.get('secure')))
+    session._cookie_bridge_version = version
+
+
+def to_driver(driver, url):
+    """把共享的cookie中属于url所在host的写入浏览器，之后打开url时带上
+
+    浏览器只能设置当前页面所在域名的cookie，所以先打开这个host的robots.txt
+    """
+    host = rate_limit.get_host(url)
+    cookies = [c for c in get_cookies() if _domain_match(host, c['domain'])]
+    if not cookies:
+        return
+    parts = url_parse.urlparse(url)
+    rate_limit.acquire(url)
+    driver.get('%s://%s/robots.txt' % (parts.scheme, parts.netloc))
+    for c in cookies:
+        try:
+            driver.add_cookie(dict((k, v) for k, v in c.items() if v is not None))
+        except WebDriverException:
+            pass
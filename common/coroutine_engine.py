@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""基于tornado协程的抓取引擎
+
+config.engine为constants.coroutine时由SpiderThread使用。列表页、公众号页和文章页的请求都在一个IOLoop里并发进行，
+同时进行中的请求数由config.coroutine_concurrency限制，每个host的请求频率仍由common.rate_limit控制。
+
+config.listing_workers个协程依次取得公众号的文章列表，放进长度为config.pipeline_queue_size的下载队列，
+config.coroutine_concurrency个协程从队列中取出下载，队列满时暂停取得文章列表。
+
+sqlite的查询和写入、交给storage.writer(队列满时阻塞)以及cookie缓存的写入都在一个单独的线程中执行，不阻塞IOLoop。
+cookie和requests会话、浏览器共用common.cookie_bridge中的cookie。
+"""
+import random
+import traceback
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+from tornado.queues import Queue
+
+import config
+import htmlparser
+from common import circuit_breaker
+from common import cookie_bridge
+from common import deadline
+from common import encoding
+from common import parse_pool
+from common import rate_control
+from common import rate_limit
+from common import settings
+from common import sogou_api
+from common.download_task import DownloadTask, DownloadedDocument, check_article_page
+from common.worker_pool import WorkerPool
+from storage.sqlite_storage import get_thread_storage
+from wechatsogou.exceptions import WechatSogouException, WechatSogouRequestsException, WechatSogouVcodeException, \
+    WechatSogouResponseTooLargeException
+
+
+class CoroutineCrawler(object):
+
+    def __init__(self, spider):
+        """
+
+        :type spider: common.download_queue.SpiderThread 用于输出日志、更新进度和检查是否被停止
+        """
+        self._spider = spider
+        self._api = sogou_api.get_wx_api()
+        self._client = None
+        self._semaphore = None
+        self._jobs = None
+        self._executor = None
+
+    def run(self, subscribes):
+        """在当前线程中新建IOLoop，抓取完所有公众号后返回
+
+        :type subscribes: list of dict {"name": 微信号} 还没有取得过文章列表的微信号，已经在队列中的任务会先被下载
+        """
+        io_loop = IOLoop()
+        io_loop.make_current()
+        # 每个协程最多同时等待一个调用，队列不会满，submit不会阻塞IOLoop
+        self._executor = WorkerPool(1, self._call, name='coroutine-io',
+                                    maxsize=config.listing_workers + config.coroutine_concurrency + 1)
+        # 先读入缓存中的cookie，之后cookie_bridge.to_header只读内存
+        cookie_bridge.get_cookies()
+        try:
+            io_loop.run_sync(lambda: self._crawl(subscribes))
+        finally:
+            self._executor.shutdown()
+            io_loop.close(all_fds=True)
+
+    @gen.coroutine
+    def _run_blocking(self, func, *args):
+        """在self._executor的线程中执行func，等待时不阻塞IOLoop
+
+        sqlite的连接按线程分开(见storage.sqlite_storage.get_thread_storage)，这些调用都使用那个线程的连接
+        """
+        future = Future()
+        self._executor.submit((func, args, future, IOLoop.current()))
+        success, value = yield future
+        if not success:
+            raise value
+        raise gen.Return(value)
+
+    @staticmethod
+    def _call(item):
+        func, args, future, io_loop = item
+        try:
+            result = (True, func(*args))
+        except Exception as e:
+            result = (False, e)
+        io_loop.add_callback(future.set_result, result)
+
+    @gen.coroutine
+    def _crawl(self, subscribes):
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=config.coroutine_concurrency)
+        self._semaphore = Semaphore(config.coroutine_concurrency)
+        self._jobs = Queue(maxsize=config.pipeline_queue_size)
+        accounts = iter(subscribes)
+        downloaders = [self._download_worker() for _ in range(config.coroutine_concurrency)]
+        try:
+            jobs = yield self._run_blocking(self._spider.claim_jobs)
+            yield self._queue_jobs(jobs)
+            yield [self._list_worker(accounts) for _ in range(config.listing_workers)]
+            # 下载完成后才知道有没有需要重试的任务
+            yield self._jobs.join()
+            yield self._wait_for_retries()
+        finally:
+            for _ in downloaders:
+                yield self._jobs.put(None)
+            yield downloaders
+            self._client.close()
+
+    @gen.coroutine
+    def _queue_jobs(self, jobs):
+        """把任务放进下载队列，队列满时等待
+        """
+        self._spider.sub_tasks += len(jobs)
+        for job in jobs:
+            yield self._jobs.put(job)
+
+    @gen.coroutine
+    def _list_worker(self, accounts):
+        """几个协程共用一个迭代器，依次取得公众号的文章列表
+        """
+        for subscribe in accounts:
+            if self._spider.stopped():
+                return
+            yield self._crawl_account(subscribe)
+
+    @gen.coroutine
+    def _download_worker(self):
+        """从下载队列取出任务下载，取到None时结束
+        """
+        while True:
+            job = yield self._jobs.get()
+            try:
+                if job is None:
+                    return
+                yield self._download(job)
+            finally:
+                self._jobs.task_done()
+
+    @gen.coroutine
+    def _wait_for_retries(self):
+        while not self._spider.stopped():
+            wait = yield self._run_blocking(self._spider.get_retry_wait)
+            if wait is None:
+                return
+            if wait:
+                # 每秒检查一次是否被停止
+                yield gen.sleep(min(wait, 1))
+                continue
+            jobs = yield self._run_blocking(self._spider.claim_jobs)
+            yield self._queue_jobs(jobs)
+            yield self._jobs.join()
+
+    @gen.coroutine
+    def _crawl_account(self, subscribe):
+        if self._spider.stopped():
+            return
+        wxid = subscribe['name']
+        self._spider.d("processing wxid=%s" % wxid)
+        try:
+            articles = yield self._get_articles_by_id(wxid)
+        except WechatSogouException as e:
+            self._spider.e(e)
+            return
+        except Exception as e:
+            self._spider.e('wxid=%s: %s' % (wxid, e))
+            print(traceback.format_exc())
+            return
+        yield self._run_blocking(self._spider.queue_articles, subscribe, articles)
+        jobs = yield self._run_blocking(self._spider.claim_jobs)
+        yield self._queue_jobs(jobs)
+        self._spider.progress += 1
+
+    @gen.coroutine
+    def _get_articles_by_id(self, wxid):
+        """同common.sogou_api.get_articles_by_id，使用wxid表中记录的水印
+        """
+        since = yield self._run_blocking(lambda: get_thread_storage().get_watermark(wxid))
+        text = yield self._fetch(self._api._search_gzh_url(wxid), host='weixin.sogou.com')
+        gzh_info = yield parse_pool.parse_async(htmlparser.search_gzh_list, text)
+        if not gzh_info:
+            raise WechatSogouException('%s not exist' % wxid)
+        gzh_info = gzh_info[0]
+        yield self._run_blocking(lambda: get_thread_storage().edit_extra(wxid, gzh_info))
+        self._spider.d('wxid: %s information updated' % wxid)
+        if since and gzh_info.get('last_time') and gzh_info['last_time'] <= since[0]:
+            self._spider.d("wxid=%s has no new posts" % wxid)
+            raise gen.Return([])
+
+        text = yield self._fetch(gzh_info['url'], host='mp.weixin.qq.com')
+        messages = yield parse_pool.parse_async(htmlparser.get_gzh_messages, text)
+        if since:
+            messages = sogou_api.filter_newer(messages, since)
+        raise gen.Return([m for m in messages if m['type'] == '49'])
+
+    @gen.coroutine
+    def _download(self, job):
+        """
+
+        :type job: storage.sqlite_storage.JobRecord
+        """
+        if self._spider.stopped() or not (yield self._run_blocking(self._spider.start_job, job)):
+            return
+        url = job['info']['content_url']
+        task = DownloadTask(job['info'], {'name': job['wxid']})
+        try:
+            body = yield self._fetch(url, host='mp.weixin.qq.com', decode=False)
+            check_article_page(body, url)
+        except Exception as e:
+            yield self._run_blocking(self._spider.retry_job, job, e)
+            return
+        self._spider.d('%s download success' % url)
+        yield self._run_blocking(
+            DownloadedDocument(body, task).save_async,
+            lambda success, msg: self._spider.finish_job(job, success, msg, persisted=True), job['hash_id'])
+
+    @gen.coroutine
+    def _fetch(self, url, host=None, referer=None, decode=True):
+        """
+
+        :param decode: 为False时返回原始的bytes
+        :raise WechatSogouRequestsException: 返回码不是200
+        :raise WechatSogouVcodeException: 出现验证码
+        :raise WechatSogouDeadlineException: 超过抓取的截止时间
+        :raise WechatSogouResponseTooLargeException: 响应体超过config.max_response_size
+        """
+        circuit_breaker.check(url)
+        wait = rate_limit.reserve(url)
+        while wait:
+            left = deadline.remaining()
+            yield gen.sleep(wait if left is None else min(wait, left))
+            wait = rate_limit.reserve(url)
+        agent = settings.agent
+        headers = {
+            "User-Agent": agent[random.randint(0, len(agent) - 1)],
+            "Referer": referer if referer else "http://weixin.sogou.com/",
+            "Host": host if host else rate_limit.get_host(url),
+        }
+        cookie = cookie_bridge.to_header(url)
+        if cookie:
+            headers['Cookie'] = cookie
+        chunks = list()
+        received = [0]
+
+        def on_chunk(chunk):
+            # 抛出异常后连接被关闭，response.code为599
+            received[0] += len(chunk)
+            if received[0] > config.max_response_size:
+                raise WechatSogouResponseTooLargeException(url, received[0])
+            chunks.append(chunk)
+
+        with (yield self._semaphore.acquire()):
+            left = deadline.remaining()
+            request_timeout = config.connect_timeout + config.read_timeout
+            request = HTTPRequest(url, headers=headers, streaming_callback=on_chunk,
+                                  connect_timeout=min(config.connect_timeout, left or config.connect_timeout),
+                                  request_timeout=min(request_timeout, left or request_timeout))
+            response = yield self._client.fetch(request, raise_error=False)
+        if received[0] > config.max_response_size:
+            raise WechatSogouResponseTooLargeException(url, received[0])
+        body = b''.join(chunks)
+        set_cookies = response.headers.get_list('Set-Cookie')
+        if set_cookies:
+            yield self._run_blocking(cookie_bridge.from_headers, url, set_cookies)
+        if response.code != 200:
+            rate_control.on_status(url, response.code)
+            raise WechatSogouRequestsException('requests status_code error', response.code)
+        if not decode:
+            raise gen.Return(body)
+        text = encoding.decode(body, response.headers)
+        if self._api._check_vcode(text)[0] or u'为了保护你的网络安全，请输入验证码' in text:
+            rate_control.on_throttle(url)
+            raise WechatSogouVcodeException('%s verification code' % host)
+        rate_control.on_success(url)
+        raise gen.Return(text)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""请求的超时、截止时间和响应大小上限
+
+每次请求都使用config.connect_timeout和config.read_timeout，不会因为一个卡住的连接一直等待。
+抓取可以设置截止时间，保存在当前线程中(SpiderThread在自己和线程池的线程中设置)，
+之后的每次请求的超时都不会超过剩余时间，截止时间已过时直接抛出异常。
+响应体边读边计数，超过config.max_response_size时中断连接，不把整个响应读进内存。
+"""
+import threading
+import time
+
+import config
+from wechatsogou.exceptions import WechatSogouDeadlineException, WechatSogouResponseTooLargeException
+
+CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+
+def set_deadline(deadline):
+    """
+
+    :param deadline: 当前线程中请求的截止时间戳，为None时不限制
+    """
+    _local.deadline = deadline
+
+
+def get_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+def remaining():
+    """
+
+    :return: 距离截止时间的秒数，没有截止时间时返回None
+    :raise WechatSogouDeadlineException: 截止时间已过
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+    left = deadline - time.time()
+    if left <= 0:
+        raise WechatSogouDeadlineException('deadline exceeded by %.1f seconds' % -left)
+    return left
+
+
+def get_timeout():
+    """
+
+    :return: requests使用的(连接超时, 读取超时)，不超过剩余时间
+    """
+    left = remaining()
+    if left is None:
+        return config.connect_timeout, config.read_timeout
+    return min(config.connect_timeout, left), min(config.read_timeout, left)
+
+
+def read_body(response, limit=None, raw=False):
+    """读取以stream=True请求的响应体，读完后response.content和response.text可以照常使用
+
+    :type response: requests.Response
+    :param limit: 字节数上限，默认为config.max_response_size
+    :param raw: 为True时返回没有解压的原始数据(同response.raw.read())，用于原样转发，response.content不可用
+    :return: bytes 响应体
+    :raise WechatSogouResponseTooLargeException: 响应体超过上限，连接已经关闭
+    """
+    limit = limit or config.max_response_size
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > limit:
+        response.close()
+        raise WechatSogouResponseTooLargeException(response.url, int(length))
+    chunks = list()
+    size = 0
+    try:
+        chunks_iter = response.raw.stream(CHUNK_SIZE, decode_content=False) if raw \
+            else response.iter_content(CHUNK_SIZE)
+        for chunk in chunks_iter:
+            size += len(chunk)
+            if size > limit:
+                raise WechatSogouResponseTooLargeException(response.url, size)
+            # 每块数据之间检查截止时间，对方一直慢慢发送时也不会超时太久
+            remaining()
+            chunks.append(chunk)
+    except Exception:
+        response.close()
+        raise
+    if raw:
+        return b''.join(chunks)
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+    return response._content
+
+
+def request(session, method, url, **kwargs):
+    """带超时、截止时间和大小上限的session.request，返回的响应已经读完
+    """
+    kwargs.setdefault('timeout', get_timeout())
+    response = session.request(method, url, stream=True, **kwargs)
+    read_body(response)
+    return response
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import threading
+
+
+class SeenSet(object):
+    """已经保存过的文章id集合
+
+    抓取开始时从数据库一次性载入，之后每保存一篇文章就加入一个id，用来在创建DownloadTask之前跳过已有的文章。
+    用普通的set而不是Bloom filter，误判会让新文章被跳过，而几十万个md5占用的内存可以接受。
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._ids = set()
+        self._lock = threading.Lock()
+
+    def load(self, db_helper):
+        """合并数据库中的id，同时进行的其他抓取已经加入的id不会丢失
+
+        :type db_helper: storage.sqlite_storage.SQLiteStorage
+        """
+        ids = db_helper.get_article_ids()
+        with self._lock:
+            self._ids.update(ids)
+            self.loaded = True
+
+    def add(self, article_id):
+        with self._lock:
+            self._ids.add(article_id)
+
+    def __contains__(self, article_id):
+        return article_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def filter_new(self, items, key):
+        """一次过滤一批文章
+
+        :param items: 文章列表
+        :param key: 从文章得到id的函数
+        :return: 不在集合中的文章
+        """
+        return [i for i in items if key(i) not in self._ids]
+
+
+_seen = SeenSet()
+
+
+def get_seen_set():
+    return _seen
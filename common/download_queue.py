@@ -1,21 +1,110 @@
 # -*- coding: utf-8 -*-
 import random
 import threading
-import traceback
 import time
-from time import sleep
+from collections import OrderedDict
 
+import config
 import constants
+from common import deadline
+from common import rate_control
+from common import retry
 from common import sogou_api
-from common.download_task import DownloadTask
-from storage.sqlite_storage import SQLiteStorage
+from common.coroutine_engine import CoroutineCrawler
+from common.dedupe import get_seen_set
+from common.download_task import DownloadTask, get_article_id
+from common.worker_pool import WorkerPool
+from storage import writer
+from storage.sqlite_storage import get_read_storage, get_thread_storage
 from wechatsogou.exceptions import WechatSogouException
 
-delay_time = 3
-
-_db_helper = SQLiteStorage()
-_failed_queue = list()
+# start()启动的抓取，/start、/stop、/rest/progress和/rest/log使用
 _thread = None
+_current = threading.local()
+
+JOB_RUNNING = 'running'
+JOB_STOPPED = 'stopped'
+JOB_CANCELLED = 'cancelled'
+JOB_DONE = 'done'
+
+
+class JobManager(object):
+    """按id管理同时进行的多个抓取，id就是crawl_run表中的run id
+
+    每个抓取有自己的日志和进度。所有抓取的请求都经过common.rate_limit中按host共用的令牌桶，
+    同时进行几个抓取时总的请求速率也不会超过限速。
+    """
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, wxid_list, run_id=None, timeout=None):
+        """新建并启动一个抓取
+
+        :type wxid_list: list of str 微信号
+        :param run_id: 要恢复的抓取，为None时新建
+        :param timeout: 抓取开始后多少秒停止，默认为config.job_deadline
+        :rtype: SpiderThread
+        """
+        if run_id is None:
+            run_id = get_thread_storage().create_run(wxid_list)
+        else:
+            get_thread_storage().release_jobs(run_id)
+        thread = SpiderThread([{'name': name} for name in wxid_list], run_id=run_id, timeout=timeout)
+        with self._lock:
+            self._jobs[run_id] = thread
+            self._prune()
+        thread.start()
+        return thread
+
+    def get(self, job_id):
+        """
+
+        :rtype: SpiderThread 没有这个抓取时返回None
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def running(self):
+        return [t for t in self.list() if t.isAlive()]
+
+    def cancel(self, job_id):
+        """停止抓取并把它标记为完成，之后不会再被start()恢复
+
+        :return: 没有这个抓取时返回False
+        """
+        thread = self.get(job_id)
+        if thread is None:
+            return False
+        thread.cancel()
+        get_thread_storage().finish_run(job_id)
+        return True
+
+    def reserved_accounts(self):
+        """
+
+        :return: 进行中的抓取里还没有取得文章列表的微信号数，这些请求已经占用了weixin.sogou.com的预算
+        """
+        return sum(t.length - t.progress for t in self.running())
+
+    def _prune(self):
+        """内存中最多保留config.job_history个已经结束的抓取
+        """
+        finished = [job_id for job_id, t in self._jobs.items() if not t.isAlive() and t.start_at]
+        for job_id in finished[:max(0, len(finished) - config.job_history)]:
+            del self._jobs[job_id]
+
+
+_manager = JobManager()
+
+
+def get_manager():
+    return _manager
 
 
 def get_bot_thread():
@@ -23,12 +112,15 @@ def get_bot_thread():
 
 
 def log_to_bot_process(flag='info', msg=''):
-    if not _thread:
+    """输出到当前线程所属的抓取，不在抓取线程中调用时输出到start()启动的抓取
+    """
+    thread = getattr(_current, 'job', None) or _thread
+    if not thread:
         return
     if flag == 'info':
-        _thread.d(msg)
+        thread.d(msg)
     elif flag == 'error':
-        _thread.e(msg)
+        thread.e(msg)
 
 
 def start():
@@ -37,15 +129,21 @@ def start():
         return False
 
     global _thread
-    wxid_list = _db_helper.get_wxid_list()
-    random.shuffle(wxid_list)
-    if status == constants.IDLE:
-        _thread = SpiderThread(wxid_list[:19])
-        if len(wxid_list) > 20:
-            _thread.d('微信号太多了会被封，随机抓取20个。')
-        _thread.start()
+    run = get_read_storage().get_unfinished_run()
+    resumed = run and _manager.get(run['id'])
+    if run and not (resumed and resumed.isAlive()):
+        # 上次没有完成的抓取，从数据库中恢复
+        _thread = _manager.create(run['wxid_list'], run_id=run['id'])
+        _thread.d('resume unfinished crawl #%s' % run['id'])
         return True
-    return False
+    wxid_list = [s['name'] for s in get_read_storage().get_wxid_list()]
+    random.shuffle(wxid_list)
+    # 和进行中的其他抓取共用预算
+    budget = max(1, rate_control.get_controller('weixin.sogou.com').account_budget() - _manager.reserved_accounts())
+    _thread = _manager.create(wxid_list[:budget])
+    if len(wxid_list) > budget:
+        _thread.d('微信号太多了会被封，随机抓取%s个。' % budget)
+    return True
 
 
 def stop():
@@ -78,6 +176,16 @@ def get_log_from(from_line=0):
     return log[from_line:]
 
 
+def get_retry_queue_depth():
+    """
+
+    :return: 当前抓取中等待重试的下载任务数
+    """
+    if not _thread or _thread.run_id is None:
+        return 0
+    return get_read_storage().count_retry_jobs(_thread.run_id)
+
+
 def get_status():
     if not _thread or not _thread.isAlive():
         return constants.IDLE
@@ -87,7 +195,7 @@ def get_status():
 def resolve(info_list):
     """
 
-    :type info_list: list of dict {
+    :type info_list: iterable of dict {
         "author": 作者,
         "content_url": 下载地址,
         "copyright_stat": 授权信息,
@@ -102,22 +210,14 @@ def resolve(info_list):
         "type": 消息类型(49是文章)
     }
     """
-    if not info_list:
-        return
-    else:
-        for info in range(0, len(info_list)):
-            task = DownloadTask(info_list.pop(0))
-            delay()
-            request = task.request()
-            if not request:
-                continue
-            success = request.save()
-            if not success:
-                _failed_queue.append(info)
-
-
-def delay():
-    return sleep(delay_time)
+    for info in info_list:
+        task = DownloadTask(info)
+        response, msg = task.request()
+        if not response:
+            continue
+        success, msg = response.save()
+        if not success:
+            print(msg)
 
 
 def _time():
@@ -125,9 +225,18 @@ def _time():
 
 
 class SpiderThread(threading.Thread):
-    def __init__(self, wxid_list):
+    def __init__(self, wxid_list, run_id=None, owner=None, timeout=None):
+        """
+
+        :param wxid_list: list of dict {"name": 微信号}
+        :param run_id: 要恢复的抓取，为None时新建
+        :param owner: worker id，见worker.py
+        :param timeout: 抓取开始后多少秒停止，默认为config.job_deadline，为None时不限制
+        """
         super(SpiderThread, self).__init__()
         self.wxid_list = wxid_list
+        self.run_id = run_id
+        self.owner = owner
         self.create_at = time.localtime()
         self.start_at = None
         self.log = list()
@@ -136,43 +245,234 @@ class SpiderThread(threading.Thread):
         self.sub_progress = 0
         self.length = len(wxid_list)
         self._stop_event = threading.Event()
+        self._progress_lock = threading.Lock()
+        self._fetch = None
+        self.cancelled = False
+        # 所有任务都已完成并记录到crawl_run，被停止、超过截止时间或出错时为False
+        self.finished = False
+        self.timeout = timeout or config.job_deadline
+        self.deadline = None
 
     def run(self):
         self.start_at = time.localtime()
-        self._generate_article_list()
+        if self.timeout:
+            self.deadline = time.time() + self.timeout
+        _current.job = self
+        deadline.set_deadline(self.deadline)
+        db_helper = get_thread_storage()
+        get_seen_set().load(db_helper)
+        rate_control.load()
+        if self.run_id is None:
+            self.run_id = db_helper.create_run([s['name'] for s in self.wxid_list], self.owner)
+        if config.engine == constants.coroutine:
+            CoroutineCrawler(self).run(self.get_unlisted())
+        else:
+            self._run_pipeline()
+        # 下载的文章全部写入后才算完成
+        if not writer.flush():
+            self.d('deadline exceeded, remaining articles are written in background')
+        if not self.stopped():
+            db_helper.finish_run(self.run_id)
+            self.finished = True
         self.d("task done")
 
     def stop(self):
+        """只设置停止标志，不等待写入线程，/stop和取消抓取在tornado的IOLoop线程中调用
+
+        已经下载的文章由run()结束前的writer.flush()写入，进程退出时由storage.writer的atexit写入
+        """
         self._stop_event.set()
         self.d('stopping thread...')
 
+    def cancel(self):
+        self.cancelled = True
+        self.stop()
+
+    def get_state(self):
+        if self.isAlive():
+            return JOB_RUNNING
+        if self.cancelled:
+            return JOB_CANCELLED
+        return JOB_STOPPED if self.stopped() else JOB_DONE
+
+    def get_info(self):
+        """
+
+        :return: dict 用于/rest/jobs
+        """
+        return {
+            'id': self.run_id,
+            'state': self.get_state(),
+            'wxid_list': [s['name'] for s in self.wxid_list],
+            'create_at': time.strftime('%Y-%m-%d %H:%M:%S', self.create_at),
+            'start_at': time.strftime('%Y-%m-%d %H:%M:%S', self.start_at) if self.start_at else None,
+            'total': self.length,
+            'progress': self.progress,
+            'sub_task_total': self.sub_tasks,
+            'sub_task_progress': self.sub_progress,
+            'retry_queue': get_read_storage().count_retry_jobs(self.run_id) if self.run_id else 0,
+            'deadline': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.deadline)) if self.deadline else None,
+        }
+
+    def _bind(self, handler):
+        """包装在线程池中执行的handler，让log_to_bot_process知道工作线程属于哪个抓取
+        """
+
+        def bound(item):
+            _current.job = self
+            deadline.set_deadline(self.deadline)
+            return handler(item)
+
+        return bound
+
     def stopped(self):
-        return self._stop_event.is_set()
+        """被停止或者超过了截止时间，超过截止时间的抓取没有完成，下次start()时会恢复
+        """
+        if self._stop_event.is_set():
+            return True
+        if self.deadline and time.time() >= self.deadline:
+            self.d('deadline exceeded, stopping thread...')
+            self._stop_event.set()
+            return True
+        return False
 
-    def _generate_article_list(self):
-        subscribes = self.wxid_list
-        # print(subscribes)
+    def get_unlisted(self):
+        """
+
+        :return: 本次抓取中还没有取得过文章列表的微信号
+        """
+        listed = get_thread_storage().get_listed_wxids(self.run_id)
+        self.progress = len([s for s in self.wxid_list if s['name'] in listed])
+        return [s for s in self.wxid_list if s['name'] not in listed]
+
+    def queue_articles(self, subscribe, all_articles):
+        """跳过已经保存的文章，其余的写入download_job表
+
+        :type subscribe: dict {"name": 微信号}
+        :type all_articles: list of dict 同DownloadTask的info
+        """
+        new_articles = get_seen_set().filter_new(all_articles, get_article_id)
+        if len(new_articles) < len(all_articles):
+            self.d("skip %s downloaded articles" % (len(all_articles) - len(new_articles)))
+        requeued = get_thread_storage().enqueue_jobs(self.run_id, subscribe['name'], new_articles,
+                                                     sogou_api.get_watermark(all_articles))
+        if requeued:
+            self.d("requeue %s unfinished articles of wxid=%s" % (requeued, subscribe['name']))
+
+    def claim_jobs(self):
+        """领取的任务在下载队列中等待时没有lease，不会被另一个列表线程重复领取
+
+        :return: list of storage.sqlite_storage.JobRecord
+        """
+        return get_thread_storage().claim_jobs(self.run_id)
+
+    def start_job(self, job):
+        """下载线程取出任务时调用，从这时开始计算config.job_lease
+
+        :return: 为False时不应该下载
+        """
+        return get_thread_storage().start_job(job['hash_id'], config.job_lease)
+
+    def finish_job(self, job, success, msg, persisted=False):
+        """记录一个下载任务的结果
+
+        :param persisted: 任务已经和文章在同一个事务中标记为完成(见storage.writer)
+        """
+        with self._progress_lock:
+            self.sub_progress += 1
+        if success:
+            if not persisted:
+                get_thread_storage().finish_job(job['hash_id'])
+            self.d(msg)
+        else:
+            get_thread_storage().fail_job(job['hash_id'], msg)
+            self.e(msg)
+
+    def retry_job(self, job, exception):
+        """下载失败时按失败类型(见common.retry)决定稍后重试还是放弃
+        """
+        error_class = retry.classify(exception)
+        msg = '%s download failed (%s): %s' % (job['info']['content_url'], error_class, exception)
+        if error_class == retry.DEADLINE:
+            # 超过截止时间没有下载的任务留在队列中，恢复抓取时继续下载
+            get_thread_storage().retry_job(job['hash_id'], msg, time.time())
+            return
+        delay = retry.get_delay(error_class, job['attempts'] + 1)
+        if delay is None:
+            self.finish_job(job, False, msg)
+            return
+        with self._progress_lock:
+            self.sub_progress += 1
+        get_thread_storage().retry_job(job['hash_id'], msg, time.time() + delay)
+        self.e('%s, retry in %d seconds' % (msg, delay))
+
+    def get_retry_wait(self):
+        """
+
+        :return: 距离下一个重试任务可以被领取的秒数，没有等待重试的任务时返回None
+        """
+        next_retry = get_thread_storage().get_next_retry(self.run_id)
+        if next_retry is None:
+            return None
+        return max(0, next_retry - time.time())
+
+    def _run_pipeline(self):
+        """取得文章列表(含去重)、下载、保存三个阶段，前两个阶段各自使用线程池，保存由storage.writer的写入线程完成，阶段之间是有界队列
+
+        下载线程在下载前面公众号的文章时，列表线程已经在取得后面公众号的文章列表；
+        等待下载的文章超过config.pipeline_queue_size时列表线程阻塞，内存占用和公众号数量无关。
+        """
+        self._fetch = WorkerPool(config.download_workers, self._bind(self._download), name='download',
+                                 maxsize=config.pipeline_queue_size)
+        listing = WorkerPool(config.listing_workers, self._bind(self._list_articles), name='listing')
+        stages = (listing, self._fetch)
         try:
-            info_list = list()
-            for s in subscribes:
+            self.resolve(self.claim_jobs())
+            for s in self.get_unlisted():
                 if self.stopped():
                     break
-                self.d("processing wxid=%s" % s['name'])
-                try:
-                    all_articles = sogou_api.get_articles_by_id(s['name'])
-                except WechatSogouException as e:
-                    self.e(e)
-                    continue
-                self.sub_tasks = len(all_articles)
-                for a in all_articles:
-                    info_list.append(a)
-                self.resolve(info_list, s)
-                self.progress += 1
-            return True
-        except Exception as e:
-            print(e.message)
-            print(traceback.format_exc())
-            return e
+                listing.submit(s)
+            # 上一级处理完时已经把结果全部交给了下一级，按顺序等待
+            for stage in stages:
+                stage.join()
+            self._wait_for_retries()
+            for stage in stages[1:]:
+                stage.join()
+        finally:
+            for stage in stages:
+                stage.shutdown()
+
+    def _wait_for_retries(self):
+        while not self.stopped():
+            wait = self.get_retry_wait()
+            if wait is None:
+                return
+            if wait:
+                if self.deadline:
+                    wait = min(wait, max(0, self.deadline - time.time()))
+                self._stop_event.wait(wait)
+                continue
+            self.resolve(self.claim_jobs())
+            self._fetch.join()
+
+    def _list_articles(self, subscribe):
+        """在列表线程中执行，取得一个公众号的新文章，写入download_job表后交给下载线程
+        """
+        if self.stopped():
+            return
+        self.d("processing wxid=%s" % subscribe['name'])
+        since = get_thread_storage().get_watermark(subscribe['name'])
+        try:
+            all_articles = sogou_api.get_articles_by_id(subscribe['name'], since)
+        except WechatSogouException as e:
+            self.e(e)
+            return
+        if since and not all_articles:
+            self.d("wxid=%s has no new posts" % subscribe['name'])
+        self.queue_articles(subscribe, all_articles)
+        self.resolve(self.claim_jobs())
+        with self._progress_lock:
+            self.progress += 1
 
     def d(self, string):
         msg = '[i] %s %s' % (_time(), string)
@@ -184,45 +484,49 @@ class SpiderThread(threading.Thread):
         self.log.append(msg)
         print(msg)
 
-    def resolve(self, info_list, subscribe):
-        """
-
-        :param subscribe: subscribe['name']订阅的微信号
-        :type info_list: list of dict {
-            "author": 作者,
-            "content_url": 下载地址,
-            "copyright_stat": 授权信息,
-            "cover": 封面图,
-            "datetime": 发布时间,
-            "digest": 简介,
-            "fileid": 文件id,
-            "main": 1,
-            "qunfa_id": 群发消息id,
-            "source_url": 外链,
-            "title": 标题,
-            "type": 消息类型(49是文章)
+    def resolve(self, jobs):
+        """把任务交给下载线程，下载队列满时阻塞
+
+        :type jobs: list of storage.sqlite_storage.JobRecord {
+            "hash_id": 文章id,
+            "wxid": 订阅的微信号,
+            "info": dict {
+                "author": 作者,
+                "content_url": 下载地址,
+                "copyright_stat": 授权信息,
+                "cover": 封面图,
+                "datetime": 发布时间,
+                "digest": 简介,
+                "fileid": 文件id,
+                "main": 1,
+                "qunfa_id": 群发消息id,
+                "source_url": 外链,
+                "title": 标题,
+                "type": 消息类型(49是文章)
+            }
         }
         """
-        if not info_list:
+        with self._progress_lock:
+            self.sub_tasks += len(jobs)
+        for job in jobs:
+            if self.stopped():
+                break
+            self._fetch.submit(job)
+
+    def _download(self, job):
+        """在下载线程中执行，每个host的请求频率由common.rate_limit控制，下载到的页面交给写入线程
+        """
+        if self.stopped() or not self.start_job(job):
             return
-        else:
-            for info in range(0, len(info_list)):
-                if self.stopped():
-                    break
-                task = DownloadTask(info_list.pop(0), subscribe)
-                response, msg = task.request()
-                if msg == 'saved':
-                    delay()
-                self.sub_progress += 1
-                if not response:
-                    self.e(msg)
-                    continue
-                else:
-                    self.d(msg)
-                success, msg = response.save()
-                if not success:
-                    _failed_queue.append(info)
-                    self.e(msg)
-                else:
-                    self.d(msg)
-        self.sub_progress = 0
+        task = DownloadTask(job['info'], {'name': job['wxid']})
+        try:
+            response, msg = task.request()
+        except Exception as e:
+            self.retry_job(job, e)
+            return
+        if not response:
+            # 文章已经存在
+            self.finish_job(job, True, msg)
+            return
+        self.d(msg)
+        response.save_async(lambda success, msg: self.finish_job(job, success, msg, persisted=True), job['hash_id'])
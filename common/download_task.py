@@ -3,17 +3,26 @@ from __future__ import print_function
 import hashlib
 import os
 import random
-import traceback
+import threading
 
 import requests
-import time
 
 import botdriver
 import common
 import constants
+from common import circuit_breaker
+from common import deadline
+from common import encoding
+from common import hybrid
+from common import rate_control
+from common import rate_limit
 from common import settings
-from storage.sqlite_storage import SQLiteStorage
-from wechatsogou import WechatCache
+from common.dedupe import get_seen_set
+from common.session_pool import get_pool
+from storage.sqlite_storage import get_thread_storage
+from storage.writer import get_writer
+from wechatsogou.exceptions import WechatSogouRequestsException, WechatSogouVcodeException, \
+    WechatSogouParseException
 import config
 import sys
 reload(sys)
@@ -29,8 +38,25 @@ def _get_encoding_from_response(r):
     Returns:
         对象编码
     """
-    encoding = requests.utils.get_encodings_from_content(r.text)
-    return encoding[0] if encoding else requests.utils.get_encoding_from_headers(r.headers)
+    return encoding.sniff(r.content, r.headers)
+
+
+def check_article_page(text, url=None):
+    """检查下载到的文章页
+
+    :param url: 不为空时把是否出现验证码报告给common.rate_control
+    :raise WechatSogouVcodeException: 出现验证码
+    :raise WechatSogouParseException: 页面中没有文章内容
+    """
+    text = encoding.decode(text)
+    if u'为了保护你的网络安全，请输入验证码' in text:
+        if url:
+            rate_control.on_throttle(url)
+        raise WechatSogouVcodeException('mp.weixin.qq.com verification code')
+    if url:
+        rate_control.on_success(url)
+    if u'id="js_content"' not in text:
+        raise WechatSogouParseException('article content not found')
 
 
 def get_article_id(info):
@@ -72,24 +98,31 @@ class DownloadTask:
         }
         """
         self._agent = settings.agent
-        self._cache = WechatCache(config.cache_dir, 60 * 60)
-        self._session = requests.session()
         self.subscribe = subscribe
 
         self.info = info
 
-    def request(self, url=None, host=None, referer=None, **kwargs):
-        db_helper = SQLiteStorage()
+    def is_downloaded(self):
         article_id = get_article_id(self.info)
-        if db_helper.get_article(article_id) is not None:
-            return None, "article %s has already exist." % article_id
+        seen = get_seen_set()
+        if seen.loaded:
+            return article_id in seen
+        return get_thread_storage().get_article(article_id) is not None
+
+    def request(self, url=None, host=None, referer=None, **kwargs):
+        if self.is_downloaded():
+            return None, "article %s has already exist." % get_article_id(self.info)
         if not url:
             url = self.info['content_url']
-        result = None
-        if self._engine == constants.request:
-            result = self._get_page_by_request(url=url)
-        elif self._engine == constants.browser:
+        # config.engine为constants.hybrid时文章页也按url改用浏览器，其余的config.engine只影响取得文章列表
+        engine = constants.hybrid if config.engine == constants.hybrid else self._engine
+        if engine == constants.browser:
             result = self._get_page_by_web_driver(url=url)
+        elif engine == constants.hybrid:
+            result = hybrid.fetch(url, lambda u: self._get_page_by_request(url=u),
+                                  lambda u: self._get_page_by_web_driver(url=u))
+        else:
+            result = self._get_page_by_request(url=url)
         return DownloadedDocument(result, self), '%s download success' % url
 
     def _get_page_by_request(self, url=None, host=None, referer=None, **kwargs):
@@ -98,18 +131,26 @@ class DownloadTask:
             "Referer": referer if referer else "http://weixin.sogou.com/",
             "Host": host if host else "mp.weixin.qq.com",
         }
-        result = self._session.get(url, headers=headers, **kwargs)
+        circuit_breaker.check(url)
+        rate_limit.acquire(url)
+        with get_pool().session() as session:
+            result = deadline.request(session, 'get', url, headers=headers, **kwargs)
+        if result.status_code != requests.codes.ok:
+            rate_control.on_status(url, result.status_code)
+            raise WechatSogouRequestsException('requests status_code error', result.status_code)
         result.encoding = _get_encoding_from_response(result)
+        check_article_page(result.text, url)
         return result
 
     @classmethod
     def _get_page_by_web_driver(cls, url=None, host=None, referer=None, **kwargs):
-        driver = botdriver.get_driver()
-        driver.get(url)
-        driver.implicitly_wait(60)
-        time.sleep(3)
-        text = common.replace_html(driver.page_source)
-        driver.close()
+        circuit_breaker.check(url)
+        with botdriver.get_pool().driver() as driver:
+            rate_limit.acquire(url)
+            driver.get(url)
+            botdriver.wait_until_ready(driver, url)
+            text = common.replace_html(driver.page_source)
+        check_article_page(text, url)
         return text
 
 
@@ -123,8 +164,14 @@ class DownloadedDocument:
     def get_save_path(self):
         return config.local_storage_path + common.get_time() + os.sep, common.get_time() + os.sep
 
+    def get_article_id(self):
+        return get_article_id(self.download_info)
+
+    def get_author(self):
+        return '' if not self.subscribe else self.subscribe["name"]
+
     def get_file_name(self):
-        return get_article_id(self.download_info) + ".html"
+        return self.get_article_id() + ".html"
 
     def write_to_file(self):
         path, url = self.get_save_path()
@@ -132,21 +179,33 @@ class DownloadedDocument:
         common.save_raw_to_file(self.content_text, path, file_name)
         return url + file_name
 
-    def insert_into_db(self):
-        db_helper = SQLiteStorage()
-        article_id = get_article_id(self.download_info)
-        if db_helper.get_article(article_id) is None:
-            author = '' if not self.subscribe else self.subscribe["name"]
-            db_helper.insert_article(self.download_info, self.write_to_file(), author)
-            return 'saved'
-        else:
-            print("article %s has already exist." % article_id)
-            return 'skipped'
+    def save_async(self, callback, job_id=None):
+        """交给storage.writer写入，不等待
+
+        :param callback: 写入后在写入线程中调用callback(success, msg)
+        :param job_id: 下载任务的hash_id，和文章在同一个事务中标记为完成
+        """
+
+        def done(success, msg):
+            if success and msg == 'saved':
+                get_seen_set().add(self.get_article_id())
+            callback(success, msg)
+
+        get_writer().submit(self, done, job_id)
 
     def save(self):
-        try:
-            msg = self.insert_into_db()
-            return True, msg
-        except Exception as e:
-            print(e.message, traceback.format_exc())
-            return False, e.message
+        """同save_async，等待写入完成
+
+        :return: (success, msg)
+        """
+        result = list()
+        event = threading.Event()
+
+        def done(success, msg):
+            result.append((success, msg))
+            event.set()
+
+        self.save_async(done)
+        while not event.wait(1):
+            pass
+        return result[0]
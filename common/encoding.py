@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""根据页面开头的字节判断编码
+
+只检查前SNIFF_BYTES个字节中的BOM、<meta charset>和XML声明，没有时使用响应头中的charset，最后才用chardet猜测，
+取得编码后页面只需要解码一次。
+"""
+import cgi
+import codecs
+import re
+
+from requests.compat import chardet
+
+SNIFF_BYTES = 4096
+
+# 先检查UTF-32，UTF-32LE的BOM以UTF-16LE的BOM开头
+_boms = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+_meta_charset = re.compile(br'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+_xml_encoding = re.compile(br'^\s*<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)["\']', re.I)
+
+# 按浏览器的习惯使用超集解码
+_supersets = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'iso-8859-1': 'cp1252',
+}
+
+
+def _normalize(name):
+    """
+    :return: python可以使用的编码名，不认识的编码返回None
+    """
+    if isinstance(name, bytes):
+        name = name.decode('ascii', 'ignore')
+    name = name.strip().lower()
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return _supersets.get(name, name)
+
+
+def _get_encoding_from_headers(headers):
+    """只使用响应头中明确给出的charset，不像requests.utils.get_encoding_from_headers那样对text/*默认ISO-8859-1
+    """
+    content_type = headers.get('Content-Type') if headers else None
+    if not content_type:
+        return None
+    _, params = cgi.parse_header(content_type)
+    charset = params.get('charset')
+    return _normalize(charset.strip('\'"')) if charset else None
+
+
+def sniff(content, headers=None):
+    """
+    :param content: bytes 页面内容
+    :param headers: 响应头，requests或tornado的都可以
+    :return: 编码名
+    """
+    for bom, name in _boms:
+        if content.startswith(bom):
+            return name
+    head = content[:SNIFF_BYTES]
+    for pattern in (_xml_encoding, _meta_charset):
+        match = pattern.search(head)
+        if match:
+            name = _normalize(match.group(1))
+            if name:
+                return name
+    name = _get_encoding_from_headers(headers)
+    if name:
+        return name
+    name = chardet.detect(content).get('encoding')
+    return _normalize(name) if name else 'utf-8'
+
+
+def decode(content, headers=None):
+    """
+    :return: unicode 页面内容
+    """
+    if not isinstance(content, bytes):
+        return content
+    return content.decode(sniff(content, headers), 'replace')
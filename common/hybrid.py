@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""requests优先、必要时改用浏览器的混合引擎，config.engine为constants.hybrid时使用
+
+先用requests请求，出现验证码、页面内容需要js生成或者解析失败时，只对这一个url改用浏览器池重新请求。
+按url模式(host和第一级路径)统计改用浏览器的比例，比例很高的模式直接使用浏览器，省掉一次注定失败的请求，
+其余的模式仍然只用requests。
+"""
+import logging
+import threading
+from collections import deque
+
+try:
+    import urlparse as url_parse
+except ImportError:
+    import urllib.parse as url_parse
+
+import config
+from wechatsogou.exceptions import WechatSogouParseException, WechatSogouVcodeException
+
+logger = logging.getLogger()
+
+# {url模式: 页面完整时包含的内容}，requests取得的页面不包含这些内容时说明需要js生成
+_page_markers = {
+    'weixin.sogou.com/weixin': ('news-list2', 'news-list', 'noresult_part1_container'),
+    'mp.weixin.qq.com/profile': ('var msgList',),
+    'mp.weixin.qq.com/s': ('id="js_content"',),
+}
+
+
+def get_pattern(url):
+    """
+    :return: host和第一级路径，例如mp.weixin.qq.com/s
+    """
+    parts = url_parse.urlparse(url)
+    return '%s/%s' % (parts.netloc, parts.path.strip('/').split('/')[0])
+
+
+def check_page(url, text):
+    """
+    :raise WechatSogouParseException: 页面中没有应有的内容
+    """
+    markers = _page_markers.get(get_pattern(url))
+    if markers and not any(m in text for m in markers):
+        raise WechatSogouParseException('%s page content not found' % get_pattern(url))
+
+
+class EscalationStats(object):
+    """按url模式统计最近config.hybrid_window次requests请求中改用浏览器的次数
+
+    直接使用浏览器的请求不计入，否则比例一旦达到阈值就再也降不下来，requests恢复正常后也不会再用
+    """
+
+    def __init__(self):
+        self._history = dict()
+        self._totals = dict()
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def record(self, url, escalated):
+        pattern = get_pattern(url)
+        with self._lock:
+            if pattern not in self._history:
+                self._history[pattern] = deque(maxlen=config.hybrid_window)
+                self._totals[pattern] = [0, 0, 0]
+            self._history[pattern].append(escalated)
+            self._totals[pattern][0] += 1
+            if escalated:
+                self._totals[pattern][1] += 1
+
+    def browser_first(self, url):
+        """最近改用浏览器的比例达到config.hybrid_browser_first_ratio时直接使用浏览器，
+        每config.hybrid_probe_interval次仍然先试一次requests，requests恢复正常后比例会降下来
+        """
+        pattern = get_pattern(url)
+        with self._lock:
+            history = self._history.get(pattern)
+            if not history or len(history) < config.hybrid_min_samples:
+                return False
+            if sum(history) < config.hybrid_browser_first_ratio * len(history):
+                return False
+            self._calls[pattern] = self._calls.get(pattern, 0) + 1
+            if self._calls[pattern] % config.hybrid_probe_interval == 0:
+                return False
+            self._totals[pattern][2] += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return dict((pattern, {
+                'requests': total,
+                'escalations': escalations,
+                'browser_first': browser_first,
+                'recent_rate': float(sum(self._history[pattern])) / len(self._history[pattern]),
+            }) for pattern, (total, escalations, browser_first) in self._totals.items())
+
+
+_stats = EscalationStats()
+
+
+def get_stats():
+    return _stats
+
+
+def fetch(url, by_request, by_browser):
+    """
+    :param by_request: 用requests请求url的函数，出现验证码或页面内容不完整时抛出异常
+    :param by_browser: 用浏览器请求url的函数
+    :return: 成功的那个函数的返回值
+    """
+    if _stats.browser_first(url):
+        return by_browser(url)
+    try:
+        result = by_request(url)
+    except (WechatSogouVcodeException, WechatSogouParseException) as e:
+        logger.info('%s: %s, retry with browser' % (url, e))
+        _stats.record(url, True)
+        return by_browser(url)
+    _stats.record(url, False)
+    return result
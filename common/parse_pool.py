@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""解析页面的进程池
+
+lxml解析和正则匹配会占用GIL，和抓取放在同一个进程时，并发抓取越多解析越慢。config.parse_processes大于0时，
+页面文本交给进程池解析，只把结果传回来。同时在解析中的页面数不超过config.parse_max_in_flight，
+超过时提交解析的线程会等待，避免抓取比解析快时待解析的页面占满内存。
+
+解析函数必须是模块级函数(例如htmlparser.search_gzh_list)，才能传给其他进程。
+"""
+import atexit
+import multiprocessing
+import pickle
+import threading
+import time
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+import config
+from common import deadline
+
+
+def _call(func, args):
+    """在子进程中执行，异常也作为结果返回，python2的apply_async出错时不会调用callback
+    """
+    try:
+        return True, func(*args)
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = Exception('%s: %s' % (e.__class__.__name__, e))
+        return False, e
+
+
+class ParsePool(object):
+
+    def __init__(self, processes, max_in_flight):
+        self.processes = processes
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def _submit(self, func, args, callback):
+        """提交前必须已经占用一个位置，解析完成后释放
+        """
+
+        def done(result):
+            self._slots.release()
+            callback(result)
+
+        self._get_pool().apply_async(_call, (func, args), callback=done)
+
+    def parse(self, func, *args):
+        """在进程池中执行func(*args)并等待结果，进程数为0时直接在当前线程执行
+
+        :raise WechatSogouDeadlineException: 等待位置或结果时超过了当前线程的截止时间
+        """
+        if not self.processes:
+            return func(*args)
+        while not self._slots.acquire(False):
+            deadline.remaining()
+            time.sleep(0.01)
+        event = threading.Event()
+        box = list()
+
+        def callback(result):
+            box.append(result)
+            event.set()
+
+        self._submit(func, args, callback)
+        # 不带timeout的wait在python2中不能被KeyboardInterrupt打断；超时放弃时位置由callback释放
+        while not event.wait(min(1, deadline.remaining() or 1)):
+            pass
+        success, value = box[0]
+        if not success:
+            raise value
+        return value
+
+    @gen.coroutine
+    def parse_async(self, func, *args):
+        """同parse，用于tornado协程，等待时不阻塞IOLoop
+        """
+        if not self.processes:
+            raise gen.Return(func(*args))
+        while not self._slots.acquire(False):
+            yield gen.sleep(0.01)
+        future = Future()
+        io_loop = IOLoop.current()
+        self._submit(func, args, lambda result: io_loop.add_callback(future.set_result, result))
+        success, value = yield future
+        if not success:
+            raise value
+        raise gen.Return(value)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+
+_pool = ParsePool(config.parse_processes, config.parse_max_in_flight)
+atexit.register(_pool.close)
+
+
+def get_pool():
+    return _pool
+
+
+def parse(func, *args):
+    return _pool.parse(func, *args)
+
+
+def parse_async(func, *args):
+    return _pool.parse_async(func, *args)
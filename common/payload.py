@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""解析页面和接口返回的JSON数据，代替eval
+
+公众号页的msgList是经过HTML转义的JSON，例如{&quot;list&quot;:...}，字符串的值里通常还会再转义一次。
+整段数据先反转义一层还原JSON结构，字符串值中剩下的转义在JSON文本上直接替换，然后用json解码一次，不用逐个处理解码后的值。
+
+    python -m common.payload    # 和原来的eval + _replace_all比较速度
+"""
+from __future__ import print_function
+
+import json
+import re
+
+# &amp;最后替换，保证只反转义一层
+_entities = (
+    ('&quot;', u'"'),
+    ('&#39;', u"'"),
+    ('&lt;', u'<'),
+    ('&gt;', u'>'),
+    ('&yen;', u'¥'),
+    ('&nbsp;', u' '),
+)
+# JSON字符串值中的实体，引号替换成\"以保持JSON合法
+_string_entities = ((u'&quot;', u'\\"'),) + _entities[1:]
+_escaped_structure = re.compile(r'^\s*[\[{]\s*&quot;')
+
+
+def unescape(s):
+    """反转义一层HTML实体
+    """
+    for entity, char in _entities:
+        s = s.replace(entity, char)
+    return s.replace('&amp;', '&')
+
+
+def _unescape_strings(s):
+    """反转义JSON文本中字符串值里的HTML实体，&amp;amp;quot;这样多次转义的也替换成一个字符
+
+    JSON的结构中不会出现&，文本中剩下的实体都在字符串值里
+    """
+    if '&' not in s:
+        return s
+    while '&amp;amp;' in s:
+        s = s.replace('&amp;amp;', '&amp;')
+    for entity, char in _string_entities:
+        s = s.replace('&amp;' + entity[1:], char).replace(entity, char)
+    return s.replace('&amp;', '&')
+
+
+def loads(payload):
+    """
+    :param payload: JSON文本，整段经过HTML转义的也可以
+    :return: dict或list，字符串值中的HTML实体已经替换
+    :raise ValueError: 不是合法的JSON
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if _escaped_structure.match(payload):
+        payload = unescape(payload)
+    return json.loads(_unescape_strings(payload))
+
+
+def _benchmark(count=500, rounds=20):
+    import time
+    import common
+
+    def replace_all(data):
+        # 原来的WechatSogouBasic._replace_all
+        if isinstance(data, dict):
+            return dict((replace_all(k), replace_all(v)) for k, v in data.items())
+        elif isinstance(data, list):
+            return [replace_all(i) for i in data]
+        elif isinstance(data, str):
+            return common.replace_html(data)
+        return data
+
+    messages = {'list': [{
+        'comm_msg_info': {'id': 1000 + i, 'datetime': 1480000000 + i, 'type': 49},
+        'app_msg_ext_info': {
+            'title': u'第%s篇文章 &amp;quot;标题&amp;quot;' % i,
+            'digest': u'摘要 &lt;%s&gt; ' % i * 10,
+            'content_url': 'http://mp.weixin.qq.com/s?__biz=MzA&amp;amp;mid=%s&amp;amp;idx=1' % i,
+            'cover': 'http://mmbiz.qpic.cn/mmbiz/%s/0?wx_fmt=jpeg' % i,
+            'is_multi': 0,
+        },
+    } for i in range(count)]}
+    # 和页面中一样把/转义成\/
+    raw = json.dumps(messages, ensure_ascii=False).encode('utf-8').replace(b'/', b'\\/')
+    escaped = raw.replace(b'&', b'&amp;').replace(b'"', b'&quot;')
+    cases = (
+        # WechatSogouBasic._get_gzh_article_by_url_dict: var msgList = {...}
+        ('msgList json', raw, lambda s: replace_all(eval(s))),
+        # htmlparser.get_gzh_article_by_url_dict: var msgList = '{&quot;...}'
+        ('msgList escaped', escaped, lambda s: eval(common.replace_html(s))),
+    )
+    print('%s messages, %s rounds' % (count, rounds))
+    for name, text, legacy in cases:
+        timings = list()
+        for parse in (legacy, loads):
+            start = time.time()
+            for _ in range(rounds):
+                parse(text)
+            timings.append((time.time() - start) / rounds * 1000)
+        print('%-16s eval: %8.2f ms  loads: %8.2f ms  %.1fx' % (name, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""AIMD自适应限速
+
+每个host一个控制器：正常响应时请求速率加config.rate_increase，出现验证码或服务端错误时乘以config.rate_decrease。
+学到的速率按config.cache_session_name保存在缓存中(每个worker有自己的预算)，下次启动时继续使用，
+并同步到common.rate_limit中对应host的令牌桶。
+"""
+import threading
+
+import config
+from common import circuit_breaker
+from common import rate_limit
+from wechatsogou.filecache import WechatCache
+
+_cache = None
+_controllers = dict()
+_lock = threading.Lock()
+
+
+class AIMDController(object):
+
+    def __init__(self, host, rate, min_rate, max_rate):
+        self.host = host
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        saved = _cache.get(self._cache_key())
+        self.rate = min(max_rate, max(min_rate, saved if saved else rate))
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._apply()
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + config.rate_increase)
+            self._apply()
+            self._unsaved += 1
+            if self._unsaved >= 20:
+                self._save()
+
+    def on_throttle(self):
+        """出现验证码或服务端错误
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * config.rate_decrease)
+            self._apply()
+            self._save()
+
+    def account_budget(self):
+        """按当前速率，config.crawl_window秒内可以抓取的微信号数量，每个微信号需要请求一次搜索页
+        """
+        return max(1, int(self.rate * config.crawl_window))
+
+    def _apply(self):
+        bucket = rate_limit.get_bucket(self.host)
+        if bucket:
+            bucket.set_rate(self.rate)
+
+    def _save(self):
+        _cache.set(self._cache_key(), self.rate, 0)
+        self._unsaved = 0
+
+    def _cache_key(self):
+        return 'rate_control_%s_%s' % (config.cache_session_name, self.host)
+
+
+def load():
+    """为config.host_rate_limits中的每个host创建控制器，恢复上次学到的速率，抓取开始前调用
+    """
+    global _cache
+    with _lock:
+        if _controllers:
+            return
+        _cache = WechatCache(config.cache_dir)
+        for host, (rate, capacity) in config.host_rate_limits.items():
+            min_rate, max_rate = config.rate_bounds.get(host, (rate, rate))
+            _controllers[host] = AIMDController(host, rate, min_rate, max_rate)
+
+
+def get_controller(host):
+    """
+
+    :return: AIMDController，config.host_rate_limits中没有配置的host返回None
+    """
+    if not _controllers:
+        load()
+    return _controllers.get(host)
+
+
+def on_success(url):
+    circuit_breaker.record(url, True)
+    controller = get_controller(rate_limit.get_host(url))
+    if controller:
+        controller.on_success()
+
+
+def on_throttle(url):
+    circuit_breaker.record(url, False)
+    controller = get_controller(rate_limit.get_host(url))
+    if controller:
+        controller.on_throttle()
+
+
+def on_status(url, status_code):
+    """根据返回码记录结果，404等客户端错误不影响速率
+    """
+    if status_code == 200:
+        on_success(url)
+    elif status_code == 429 or status_code >= 500:
+        on_throttle(url)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+try:
+    import urlparse as url_parse
+except ImportError:
+    import urllib.parse as url_parse
+
+import config
+from common import deadline
+
+_buckets = dict()
+_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """令牌桶，按rate(个/秒)补充令牌，最多积攒capacity个
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待，最多等到当前线程的截止时间
+
+        :return: 等待的秒数
+        :raise WechatSogouDeadlineException: 等到截止时间还没有取到令牌
+        """
+        waited = 0.0
+        wait = self.reserve()
+        while wait:
+            left = deadline.remaining()
+            if left is not None:
+                wait = min(wait, left)
+            time.sleep(wait)
+            waited += wait
+            wait = self.reserve()
+        return waited
+
+    def reserve(self):
+        """不阻塞地尝试取走一个令牌
+
+        :return: 0表示已取到令牌，否则为还需等待的秒数
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+def get_host(url):
+    return url_parse.urlparse(url).netloc.split(':')[0]
+
+
+def get_bucket(host):
+    """取得host对应的令牌桶，config.host_rate_limits中没有配置的host不限速
+
+    :param host: 例如mp.weixin.qq.com
+    :return: TokenBucket或None
+    """
+    with _lock:
+        bucket = _buckets.get(host)
+        if bucket is None and host in config.host_rate_limits:
+            rate, capacity = config.host_rate_limits[host]
+            bucket = TokenBucket(rate, capacity)
+            _buckets[host] = bucket
+        return bucket
+
+
+def acquire(url):
+    """请求url之前调用，按host的预算等待
+    """
+    bucket = get_bucket(get_host(url))
+    if bucket:
+        return bucket.acquire()
+    return 0.0
+
+
+def reserve(url):
+    """acquire的非阻塞版本，供协程引擎使用
+
+    :return: 0表示可以立即请求，否则为还需等待的秒数
+    """
+    bucket = get_bucket(get_host(url))
+    if bucket:
+        return bucket.reserve()
+    return 0
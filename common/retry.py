@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import random
+
+import requests
+
+import config
+from wechatsogou.exceptions import WechatSogouException, WechatSogouRequestsException, \
+    WechatSogouVcodeException, WechatSogouParseException, WechatSogouDeadlineException, \
+    WechatSogouResponseTooLargeException, WechatSogouCircuitOpenException
+
+# 失败类型，对应config.retry_policy中的key
+TIMEOUT = 'timeout'
+STATUS = 'status'
+VCODE = 'vcode'
+SOGOU = 'sogou'
+PARSE = 'parse'
+DEADLINE = 'deadline'
+CIRCUIT = 'circuit'
+TOO_LARGE = 'too_large'
+UNKNOWN = 'unknown'
+
+
+def classify(exception):
+    """
+
+    :return: 失败类型
+    """
+    if isinstance(exception, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return TIMEOUT
+    if isinstance(exception, WechatSogouRequestsException):
+        # tornado的超时和连接错误返回599
+        return TIMEOUT if exception.status_code == 599 else STATUS
+    if isinstance(exception, WechatSogouVcodeException):
+        return VCODE
+    if isinstance(exception, WechatSogouParseException):
+        return PARSE
+    if isinstance(exception, WechatSogouCircuitOpenException):
+        return CIRCUIT
+    if isinstance(exception, WechatSogouDeadlineException):
+        return DEADLINE
+    if isinstance(exception, WechatSogouResponseTooLargeException):
+        return TOO_LARGE
+    if isinstance(exception, WechatSogouException):
+        return SOGOU
+    return UNKNOWN
+
+
+def get_delay(error_class, attempts):
+    """第attempts次失败之后，下一次重试前等待的秒数
+
+    :return: 秒数，不应再重试时返回None
+    """
+    policy = config.retry_policy.get(error_class)
+    if not policy:
+        return None
+    max_attempts, base_delay = policy
+    if attempts >= max_attempts:
+        return None
+    delay = min(config.retry_max_delay, base_delay * 2 ** (attempts - 1))
+    # 一半固定一半随机，避免同一批失败的任务同时重试
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import threading
+from contextlib import contextmanager
+
+import requests
+
+import config
+from common import cookie_bridge
+
+
+class SessionPool(object):
+    """进程内共享的requests.Session池
+
+    每个session有自己的cookie和keep-alive连接，借出后由一个线程独占，用完归还以复用已建立的TCP/TLS连接。
+    借出时写入common.cookie_bridge中共享的cookie。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._idle = list()
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        session = None
+        with self._lock:
+            if self._idle:
+                self.hits += 1
+                session = self._idle.pop()
+            else:
+                self.misses += 1
+        if session is None:
+            session = requests.session()
+            if config.proxies:
+                session.proxies.update(config.proxies)
+        # 带上浏览器解封验证码后得到的cookie
+        cookie_bridge.to_session(session)
+        return session
+
+    def checkin(self, session):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(session)
+                return
+        session.close()
+
+    @contextmanager
+    def session(self):
+        s = self.checkout()
+        try:
+            yield s
+        finally:
+            self.checkin(s)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_pool = SessionPool(config.session_pool_size)
+
+
+def get_pool():
+    return _pool
@@ -1,19 +1,65 @@
 # -*- coding: utf-8 -*-
+import threading
+
 from wechatsogou import WechatSogouApi
+from wechatsogou.exceptions import WechatSogouException
 
 _api = WechatSogouApi()
+# 所有抓取共用_api的requests会话和_vcode_url，列表线程和同时进行的多个抓取依次请求搜狗
+lock = threading.RLock()
 
 
 def get_wx_api():
     return _api
 
 
-def get_articles_by_id(account_id):
-    account_id = account_id.encode('UTF-8')
+def get_articles_by_id(account_id, since=None):
+    """
+
+    :param account_id: 微信号
+    :param since: 水印(datetime, qunfa_id)，只返回比它新的文章。搜索结果中最近一篇文章不比它新时，不再请求文章列表页
+    """
+    with lock:
+        return _get_articles_by_id(account_id.encode('UTF-8'), since)
+
+
+def _get_articles_by_id(account_id, since):
     api = get_wx_api()
-    articles = api.get_gzh_message(wechatid=account_id)
+    if since is None:
+        articles = api.get_gzh_message(wechatid=account_id)
+    else:
+        gzh_info = api.get_gzh_info(account_id)
+        if not gzh_info:
+            raise WechatSogouException('%s not exist' % account_id)
+        if gzh_info.get('last_time') and gzh_info['last_time'] <= since[0]:
+            return []
+        articles = filter_newer(api.get_gzh_message(url=gzh_info['url']), since)
     result = []
     for a in articles:
         if a['type'] == '49':
             result.append(a)
     return result
+
+
+def _get_position(message):
+    return int(message['datetime'] or 0), int(message['qunfa_id'] or 0)
+
+
+def filter_newer(messages, since):
+    """
+
+    :param since: 水印(datetime, qunfa_id)
+    :return: 严格比水印新的消息
+    """
+    since = tuple(since)
+    return [m for m in messages if _get_position(m) > since]
+
+
+def get_watermark(messages):
+    """
+
+    :return: messages中最新的(datetime, qunfa_id)，messages为空时返回None
+    """
+    if not messages:
+        return None
+    return max(_get_position(m) for m in messages)
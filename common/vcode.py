@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
 import traceback
 
 from PIL import Image
 
+import botdriver
 import config
 from common import download_queue
 
@@ -12,6 +14,8 @@ VCODE_FROM_ARTICLE_LIST = 'article_list'
 temp_driver = None
 solved = False
 vcode_type = None
+# 同时只有一个验证码会话，从create_session到close_session期间持有，上面的全局变量属于持有锁的线程
+lock = threading.RLock()
 
 
 def generate_code(vcode_from=VCODE_FROM_ARTICLE_LIST):
@@ -101,10 +105,7 @@ def create_session(driver, vcode_from=VCODE_FROM_ARTICLE_LIST):
 def close_session():
     global temp_driver
     if temp_driver:
-        try:
-            temp_driver.close()
-        except:
-            pass
+        botdriver.quit_driver(temp_driver)
         temp_driver = None
     try:
         if vcode_type == VCODE_FROM_ARTICLE_LIST:
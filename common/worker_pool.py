@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import threading
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+_sentinel = object()
+
+
+class WorkerPool(object):
+    """固定大小的线程池，handler在工作线程中逐个处理submit进来的item
+
+    handler中可以把结果submit给下一个WorkerPool，下一级的队列满时handler会阻塞，几个WorkerPool就连成了有界队列连接的流水线
+    """
+
+    def __init__(self, size, handler, name='worker', maxsize=None):
+        """
+
+        :param maxsize: 队列长度上限，默认为size * 2
+        """
+        self._handler = handler
+        self._queue = queue.Queue(maxsize=maxsize or size * 2)
+        self._threads = list()
+        for i in range(size):
+            t = threading.Thread(target=self._work, name='%s-%s' % (name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, item):
+        """队列满时阻塞，防止一次塞进过多任务
+        """
+        self._queue.put(item)
+
+    def join(self):
+        """等待已提交的item全部处理完
+        """
+        self._queue.join()
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(_sentinel)
+        for t in self._threads:
+            t.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _sentinel:
+                    return
+                self._handler(item)
+            except Exception as e:
+                print(e)
+                print(traceback.format_exc())
+            finally:
+                self._queue.task_done()
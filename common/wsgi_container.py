@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""在线程池中执行部分请求的WSGIContainer
+
+tornado的WSGIContainer在IOLoop线程中逐个执行flask的请求，一个慢查询会挡住所有请求。
+路径以指定前缀开头的只读请求交给线程池执行，每个线程用自己的只读数据库连接(见storage.sqlite_storage.get_read_storage)，
+执行完后回到IOLoop线程写响应；其余请求仍在IOLoop线程中执行，行为不变。
+
+_run和_write拆开的是tornado 4.4 WSGIContainer.__call__的代码，并调用了它的私有方法_log，
+依赖requirements.txt中固定的tornado==4.4.2。升级tornado时要对照新版本的WSGIContainer修改这两个方法。
+"""
+from __future__ import print_function
+
+import traceback
+
+import tornado
+from tornado import escape
+from tornado import httputil
+from tornado.ioloop import IOLoop
+from tornado.wsgi import WSGIContainer
+
+from common.worker_pool import WorkerPool
+
+# 等待执行的请求数上限，超过时IOLoop线程阻塞
+QUEUE_SIZE = 100
+
+
+class ThreadedWSGIContainer(WSGIContainer):
+
+    def __init__(self, wsgi_application, threads, prefixes):
+        """
+
+        :param threads: 线程池大小
+        :param prefixes: 在线程池中执行的请求路径前缀，这些请求的处理函数必须是线程安全的，
+                         前缀要写到具体的路由，不能包含会请求搜狗等外部网站的路由
+        """
+        super(ThreadedWSGIContainer, self).__init__(wsgi_application)
+        self._prefixes = tuple(prefixes)
+        self._pool = WorkerPool(threads, self._handle, name='wsgi', maxsize=QUEUE_SIZE)
+
+    def __call__(self, request):
+        if not request.path.startswith(self._prefixes):
+            return super(ThreadedWSGIContainer, self).__call__(request)
+        self._pool.submit((request, IOLoop.current()))
+
+    def _handle(self, item):
+        request, io_loop = item
+        try:
+            response = self._run(request)
+        except Exception:
+            print(traceback.format_exc())
+            response = (500, 'Internal Server Error', [], b'')
+        io_loop.add_callback(self._write, request, *response)
+
+    def _run(self, request):
+        """在线程池中执行，同WSGIContainer.__call__中调用wsgi_application的部分
+
+        :return: (状态码, reason, headers, body)
+        """
+        data = {}
+        response = []
+
+        def start_response(status, response_headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = response_headers
+            return response.append
+
+        app_response = self.wsgi_application(WSGIContainer.environ(request), start_response)
+        try:
+            response.extend(app_response)
+            body = b"".join(response)
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+        if not data:
+            raise Exception("WSGI app did not call start_response")
+        status_code, reason = data["status"].split(' ', 1)
+        return int(status_code), reason, data["headers"], escape.utf8(body)
+
+    def _write(self, request, status_code, reason, headers, body):
+        """在IOLoop线程中执行，同WSGIContainer.__call__中写响应的部分
+        """
+        header_set = set(k.lower() for (k, v) in headers)
+        if status_code != 304:
+            if "content-length" not in header_set:
+                headers.append(("Content-Length", str(len(body))))
+            if "content-type" not in header_set:
+                headers.append(("Content-Type", "text/html; charset=UTF-8"))
+        if "server" not in header_set:
+            headers.append(("Server", "TornadoServer/%s" % tornado.version))
+        start_line = httputil.ResponseStartLine("HTTP/1.1", status_code, reason)
+        header_obj = httputil.HTTPHeaders()
+        for key, value in headers:
+            header_obj.add(key, value)
+        request.connection.write_headers(start_line, header_obj, chunk=body)
+        request.connection.finish()
+        self._log(status_code, request)
@@ -7,12 +7,115 @@ debug = False
 
 # flask http端口
 http_port = 6303
+# 并发执行文章、日期和微信号列表查询的线程数，其余请求在tornado的IOLoop线程中依次执行
+http_read_threads = 4
 
 force_ssl = False
 
 # 取得页面信息的方法
 engine = constants.browser
 
+# engine为constants.hybrid时，按url模式统计最近hybrid_window次requests请求，
+# 至少有hybrid_min_samples次且其中改用浏览器的比例达到hybrid_browser_first_ratio时直接使用浏览器，
+# 每hybrid_probe_interval次仍先试一次requests
+hybrid_window = 50
+hybrid_min_samples = 20
+hybrid_browser_first_ratio = 0.8
+hybrid_probe_interval = 10
+
+# engine为constants.coroutine时，同时进行中的请求数上限
+coroutine_concurrency = 20
+
+# 同时下载文章的线程数
+download_workers = 3
+# 同时取得文章列表的线程数(engine为constants.coroutine时是协程数)，
+# 线程之间对搜狗的请求依次进行(见common.sogou_api)，多出的线程在其他线程等待下载队列时继续取得列表
+listing_workers = 2
+# 等待下载的文章数上限，超过时暂停取得文章列表，抓取再多公众号内存占用也不会增长
+pipeline_queue_size = 50
+
+# 解析页面的进程数，为0时在抓取线程中解析。进程池在第一次解析时fork，这时其他线程持有的锁会被带进子进程，
+# 开启前要确认没有问题，例如设为multiprocessing.cpu_count() - 1
+parse_processes = 0
+# 同时在解析中的页面数上限，超过时抓取线程等待
+parse_max_in_flight = 16
+
+# 下载任务被领取后多少秒内没有完成，会被重新领取
+job_lease = 300
+
+# 下载失败后的重试策略 {失败类型: (最多尝试次数, 第一次重试前等待的秒数)}，之后每次等待时间翻倍
+# 失败类型见common.retry，没有列出的类型不重试
+retry_policy = {
+    'timeout': (5, 10),
+    'status': (3, 30),
+    'vcode': (3, 300),
+    'sogou': (2, 60),
+    'parse': (2, 60),
+    'circuit': (10, 60),
+}
+retry_max_delay = 30 * 60
+
+# 复用的requests.Session数量
+session_pool_size = 5
+
+# 每次请求的连接超时和读取超时(秒)，浏览器加载页面的超时也使用read_timeout
+connect_timeout = 5
+read_timeout = 20
+# 响应体的字节数上限，超过时中断下载
+max_response_size = 5 * 1024 * 1024
+# 每次抓取的截止时间(开始后的秒数)，为None时不限制，/rest/jobs可以单独指定
+job_deadline = None
+
+# 复用的浏览器(WebDriver)数量，engine为constants.browser时使用
+browser_pool_size = 2
+# 一个浏览器加载多少个页面后重启
+browser_max_pages = 50
+# 浏览器打开页面后等待页面可以读取的最长秒数
+browser_ready_timeout = 10
+# 抓取时浏览器不加载图片和静态资源，只请求browser_allowed_hosts中的host，验证码截图不受影响
+browser_lean = True
+browser_allowed_hosts = ('weixin.sogou.com', 'mp.weixin.qq.com')
+
+# 每个host的请求预算 (每秒请求数, 最多可积攒的请求数)
+host_rate_limits = {
+    'mp.weixin.qq.com': (1.0, 3),
+    'weixin.sogou.com': (1.0 / 3, 1),
+}
+
+# 熔断(common.circuit_breaker): 最近breaker_window次请求中失败的比例达到breaker_failure_ratio时熔断，
+# 至少有breaker_min_requests次请求时才判断
+breaker_window = 20
+breaker_min_requests = 5
+breaker_failure_ratio = 0.5
+# 熔断多少秒后放行一个试探请求，连续熔断时加倍，最多breaker_max_open_seconds秒
+breaker_open_seconds = 60
+breaker_max_open_seconds = 30 * 60
+
+# 自适应限速(common.rate_control): 每次正常响应增加的请求速率(次/秒)，出现验证码或服务端错误时速率乘以的系数
+rate_increase = 0.005
+rate_decrease = 0.5
+# 每个host请求速率的 (下限, 上限)
+rate_bounds = {
+    'mp.weixin.qq.com': (0.1, 5.0),
+    'weixin.sogou.com': (0.02, 2.0),
+}
+# 每次抓取的微信号数量 = weixin.sogou.com的请求速率 * crawl_window
+crawl_window = 60
+# 内存中保留的已经结束的抓取数量，用于/rest/jobs查看日志和进度
+job_history = 20
+
+# 请求使用的代理，例如{'http': 'http://127.0.0.1:8080'}，为None时直连
+proxies = None
+
+# worker.py: 每次领取的微信号数量
+worker_batch_size = 5
+# worker.py: 领取的微信号多少秒内没有续约会被其他worker领取
+wxid_lease = 600
+# worker.py: 同一个微信号两次抓取的最小间隔(秒)
+worker_recrawl_interval = 6 * 60 * 60
+# worker.py: 没有可领取的微信号时等待的秒数
+worker_idle_sleep = 60
+
 # 缓存配置
 cache_dir = 'cache'
 cache_session_name = 'requests_wechatsogou_session'
@@ -68,6 +171,16 @@ local_storage_raw_file_path = local_storage_path + 'raw' + os.sep
 # 数据库目录
 db_path = os.path.join(current_path, "data") + os.sep
 db_file = 'meta.db'
+# 每个sqlite连接的页缓存大小(KB)
+sqlite_cache_kb = 20000
+# 使用WAL模式，写入不会阻塞读取。WAL需要同一台机器上的共享内存，
+# 多台机器上的worker通过网络文件系统共用数据库时必须设为False
+sqlite_wal = True
+# 文章写入线程(storage.writer)每个事务最多写入的文章数，以及第一篇文章进入队列后最多等待多少秒提交
+writer_batch_size = 50
+writer_flush_interval = 1.0
+# 等待写入的文章数上限，超过时下载线程等待
+writer_queue_size = 200
 
 # web资源目录
 web_source_path = os.path.join(current_path, "webapp") + os.sep
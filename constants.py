@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 browser = 'browser'
 request = 'request'
+coroutine = 'coroutine'
+hybrid = 'hybrid'
 chrome = 'chrome'
 phantomjs = 'phantomjs'
 
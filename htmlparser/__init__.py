@@ -8,6 +8,97 @@ from lxml import etree
 from PIL import Image
 
 import common
+from common import payload
+from .extractor import Extractor, Field
+
+_red_mark = re.compile('red_beg|red_end')
+_gzh_info_split = re.compile(u'微信号:|月发文|篇|平均阅读')
+# 公众号页中的msgList有 var msgList = '{&quot;...}'; 和 var msgList = {...}; 两种写法
+_msg_list = re.compile("var msgList = '(.+?)';", re.S)
+_msg_list_object = re.compile("var msgList = (.+?)};", re.S)
+_article_content = re.compile(u'<div class="rich_media_content " id="js_content">(.*?)</div>', re.S)
+_qrcode = etree.XPath('//*[@id="js_pc_qr_code_img"]/@src')
+
+
+def _strip_red(s):
+    """去掉搜狗标记搜索关键字的red_beg、red_end
+    """
+    return _red_mark.sub('', s)
+
+
+def _replace_space(s):
+    s = s.replace(' ', '')
+    s = s.replace('\r\n', '')
+    return s
+
+
+def _split_gzh_info(item):
+    info = _gzh_info_split.split(item.pop('info'))
+    try:
+        item['wechatid'] = info[1]
+    except IndexError:
+        item['wechatid'] = ''
+    try:
+        item['post_perm'] = int(info[2])
+    except IndexError:
+        item['post_perm'] = 0
+    try:
+        item['read_count'] = int(info[4])
+    except IndexError:
+        item['read_count'] = 0
+    return item
+
+
+# 搜索公众号结果页中的每个公众号
+search_gzh_extractor = Extractor('//ul[@class="news-list2"]/li', [
+    Field('url', 'div/div[1]/a/@href', default=Field.REQUIRED),
+    Field('img', 'div/div[1]/a/img/@src', default=Field.REQUIRED),
+    Field('name', 'div/div[2]/p[1]', text=True, convert=_strip_red, default=Field.REQUIRED),
+    Field('info', 'div/div[2]/p[2]', text=True, default=Field.REQUIRED),
+    Field('qrcode', 'div/div[3]/span/img[1]/@src'),
+    Field('jieshao', 'dl[1]/dd', text=True, convert=_strip_red, default=Field.REQUIRED),
+    Field('renzhen', 'dl[2]/dd/text()'),
+    Field('last_time', './/script/text()', join=True, regex=r"timeConvert\('(\d+)'\)", convert=int, default=0),
+], post=_split_gzh_info)
+
+# 搜索文章结果页中的每篇文章
+search_article_extractor = Extractor("//div[@class='wx-rb wx-rb3']", [
+    Field('img', 'div[1]/a/img/@src'),
+    Field('url', 'div[2]/h4/a/@href', default=Field.REQUIRED),
+    Field('name', 'div[2]/h4', text=True, convert=_strip_red),
+    Field('zhaiyao', 'div[2]/p', text=True, convert=_strip_red),
+    Field('gzhname', 'div[2]/div/a/@title'),
+    Field('gzhqrcodes', 'div[2]/div/a/@data-encqrcodeurl'),
+    Field('gzhurl', 'div[2]/div/a/@href'),
+    Field('time', 'div[2]/div/span/script/text()', regex=r"vrTimeHandle552write\('(.*?)'\)"),
+])
+
+# 公众号页中的公众号信息
+profile_extractor = Extractor("//div[@class='profile_info_area']", [
+    Field('img', 'div[1]/span/img/@src', default=Field.REQUIRED),
+    Field('name', 'div[1]/div/strong/text()', convert=_replace_space, default=Field.REQUIRED),
+    Field('wechatid', 'div[1]/div/p/text()', convert=lambda s: s.replace(u'微信号: ', '')),
+    Field('introduction', 'ul/li[1]/div/text()', default=Field.REQUIRED),
+    Field('authentication', 'ul/li[2]/div/text()'),
+])
+
+
+def search_gzh_list(text):
+    """搜索公众号结果页
+
+    Returns:
+        list of dict，字段同WechatSogouApi.search_gzh_info
+    """
+    return search_gzh_extractor.extract(text)
+
+
+def search_article_list(text):
+    """搜索文章结果页
+
+    Returns:
+        list of dict，字段同WechatSogouApi.search_article_info
+    """
+    return search_article_extractor.extract(text)
 
 
 def get_gzh_article_gzh_by_url_dict(text, url):
@@ -27,29 +118,11 @@ def get_gzh_article_gzh_by_url_dict(text, url):
         url: 最近文章地址
     """
     page = etree.HTML(text)
-    profile_info_area = page.xpath("//div[@class='profile_info_area']")[0]
-    img = profile_info_area.xpath('div[1]/span/img/@src')[0]
-    name = profile_info_area.xpath('div[1]/div/strong/text()')[0]
-    name = _replace_space(name)
-    wechatid = profile_info_area.xpath('div[1]/div/p/text()')
-    if wechatid:
-        wechatid = wechatid[0].replace(u'微信号: ', '')
-    else:
-        wechatid = ''
-    introduction = profile_info_area.xpath('ul/li[1]/div/text()')[0]
-    authentication = profile_info_area.xpath('ul/li[2]/div/text()')
-    authentication = authentication[0] if authentication else ''
-    qrcode = page.xpath('//*[@id="js_pc_qr_code_img"]/@src')[0]
-    qrcode = 'http://mp.weixin.qq.com/' + qrcode if qrcode else ''
-    return {
-        'name': name,
-        'wechatid': wechatid,
-        'introduction': introduction,
-        'authentication': authentication,
-        'qrcode': qrcode,
-        'img': img,
-        'url': url
-    }
+    info = profile_extractor.extract(page)[0]
+    qrcode = _qrcode(page)[0]
+    info['qrcode'] = 'http://mp.weixin.qq.com/' + qrcode if qrcode else ''
+    info['url'] = url
+    return info
 
 
 def get_gzh_article_by_url_dict(text):
@@ -60,10 +133,29 @@ def get_gzh_article_by_url_dict(text):
 
     Returns:
         msgdict: 最近文章信息字典
+
+    Raises:
+        ValueError: 页面中没有msgList
     """
-    msglist = re.findall("var msgList = '(.+?)';", text, re.S)[0]
-    msgdict = eval(_replace_html(msglist))
-    return msgdict
+    msglist = _msg_list.findall(text)
+    if msglist:
+        return payload.loads(msglist[0])
+    msglist = _msg_list_object.findall(text)
+    if msglist:
+        return payload.loads(msglist[0] + '}')
+    raise ValueError('got a wrong page')
+
+
+def get_gzh_messages(text):
+    """最近文章页 群发消息，同_deal_gzh_article_dict(get_gzh_article_by_url_dict(text))
+    """
+    return _deal_gzh_article_dict(get_gzh_article_by_url_dict(text))
+
+
+def get_article_content(text):
+    """文章页 正文的html
+    """
+    return _article_content.findall(text)[0]
 
 
 def _deal_gzh_article_dict(msgdict, **kwargs):
@@ -155,32 +247,3 @@ def _deal_gzh_article_dict(msgdict, **kwargs):
         else:
             items_new.append(item)
     return items_new
-
-
-def _replace_space(s):
-    s = s.replace(' ', '')
-    s = s.replace('\r\n', '')
-    return s
-
-
-def _replace_html(s):
-    """替换html‘&quot;’等转义内容为正常内容
-
-    Args:
-        s: 文字内容
-
-    Returns:
-        s: 处理反转义后的文字
-    """
-    s = s.replace('&#39;', '\'')
-    s = s.replace('&quot;', '"')
-    s = s.replace('&amp;', '&')
-    s = s.replace('&gt;', '>')
-    s = s.replace('&lt;', '<')
-    s = s.replace('&yen;', '¥')
-    s = s.replace('amp;', '')
-    s = s.replace('&lt;', '<')
-    s = s.replace('&gt;', '>')
-    s = s.replace('&nbsp;', ' ')
-    s = s.replace('\\', '')
-    return s
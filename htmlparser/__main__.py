@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""抽取速度测试，使用保存下来的页面，例如common.save_raw_error_log保存在data/html/raw中的页面
+
+    python -m htmlparser data/html/raw/*.html
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import time
+
+import htmlparser
+
+# (页面中包含的内容, 名称, 抽取函数)
+_page_types = (
+    ('news-list2', 'search_gzh', htmlparser.search_gzh_list),
+    ('wx-rb wx-rb3', 'search_article', htmlparser.search_article_list),
+    ('profile_info_area', 'profile', lambda text: htmlparser.get_gzh_article_gzh_by_url_dict(text, '')),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='htmlparser extractor benchmark')
+    parser.add_argument('pages', nargs='+', help='保存下来的搜索结果页或公众号页')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    for path in args.pages:
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        for marker, name, extract in _page_types:
+            if marker in text:
+                break
+        else:
+            print('%s: unknown page' % path)
+            continue
+        results = extract(text)
+        start = time.time()
+        for _ in range(args.rounds):
+            extract(text)
+        elapsed = time.time() - start
+        print('%s: %s, %s results, %.1f pages/s' % (
+            path, name, len(results) if isinstance(results, list) else 1, args.rounds / elapsed))
+
+
+if __name__ == '__main__':
+    main()
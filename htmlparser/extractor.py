@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""预编译的页面抽取规则
+
+一个Extractor描述一种结果块(例如搜索结果中的一个<li>)和块中的字段，XPath和正则在导入时编译。
+抽取时每个结果块只遍历一次，依次取出所有字段，不再对整个文档为每个字段各查询一遍再按下标拼接。
+"""
+import re
+
+from lxml import etree
+
+
+def get_elem_text(elem):
+    """元素中所有文字去掉首尾空白后拼接，同WechatSogouBasic._get_elem_text
+    """
+    return ''.join(node.strip() for node in elem.itertext())
+
+
+class Field(object):
+    """结果块中的一个字段
+
+    Args:
+        name: 字段名
+        xpath: 相对于结果块的XPath
+        text: 为True时取第一个匹配元素的全部文字，否则取第一个匹配的字符串(属性值或text())
+        join: 为True时把所有匹配的字符串拼接后再处理，用于script中的内容
+        regex: 对取到的字符串再用正则取第一组
+        convert: 对最后结果的处理函数，例如int
+        default: 没有匹配时的值，为Field.REQUIRED时没有匹配会抛出ValueError
+    """
+    REQUIRED = object()
+
+    def __init__(self, name, xpath, text=False, join=False, regex=None, convert=None, default=''):
+        self.name = name
+        self.xpath = etree.XPath(xpath)
+        self.text = text
+        self.join = join
+        self.regex = re.compile(regex) if regex else None
+        self.convert = convert
+        self.default = default
+
+    def extract(self, node):
+        found = self.xpath(node)
+        if self.join:
+            found = [''.join(found)] if found else []
+        value = None
+        if found:
+            value = get_elem_text(found[0]) if self.text else found[0]
+            if self.regex:
+                match = self.regex.search(value)
+                value = match.group(1) if match else None
+        if value is None:
+            if self.default is Field.REQUIRED:
+                raise ValueError('field %s not found' % self.name)
+            return self.default
+        return self.convert(value) if self.convert else value
+
+
+class Extractor(object):
+    """
+    Args:
+        block: 结果块的XPath
+        fields: list of Field
+        post: 对每个结果字典的处理函数，可以增加或修改字段
+    """
+
+    def __init__(self, block, fields, post=None):
+        self.block = etree.XPath(block)
+        self.fields = fields
+        self.post = post
+
+    def extract(self, page):
+        """
+        Args:
+            page: 页面文本或etree.HTML()的结果
+
+        Returns:
+            list of dict，每个结果块一项
+
+        Raises:
+            ValueError: 必需的字段没有找到
+        """
+        if not isinstance(page, etree._Element):
+            page = etree.HTML(page)
+        results = list()
+        for node in self.block(page):
+            item = dict((f.name, f.extract(node)) for f in self.fields)
+            if self.post:
+                item = self.post(item)
+            results.append(item)
+        return results
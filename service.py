@@ -22,17 +22,23 @@ from flask import send_file
 from flask import send_from_directory
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
-from tornado.wsgi import WSGIContainer
 
+import botdriver
 import common
 import constants
 import web_service
+from common import circuit_breaker
+from common import deadline
 from common import download_queue
+from common import hybrid
 import config
+from common import session_pool
 from common import sogou_api
 from common import vcode
+from common.wsgi_container import ThreadedWSGIContainer
 from response_body import get_success_response, get_error_response, ResponseBody
-from storage.sqlite_storage import SQLiteStorage
+from storage import writer
+from storage.sqlite_storage import get_read_storage, get_thread_storage
 
 app = Flask(__name__)
 
@@ -62,7 +68,6 @@ check_path(config.local_storage_path,
            config.log_path,
            config.local_storage_raw_file_path,
            config.web_path)
-sqlite_helper = SQLiteStorage()
 
 
 @app.before_request
@@ -156,7 +161,8 @@ def web_resource(path):
 def search_account_by_name(account_name):
     account_name = account_name.encode('UTF-8')
     api = sogou_api.get_wx_api()
-    result = api.search_gzh_info(account_name)
+    with sogou_api.lock:
+        result = api.search_gzh_info(account_name)
     return flask.jsonify(result)
 
 
@@ -165,7 +171,8 @@ def search_account_by_name(account_name):
 def search_account_by_id(account_id):
     account_id = account_id.encode('UTF-8')
     api = sogou_api.get_wx_api()
-    result = api.search_gzh_info(account_id)
+    with sogou_api.lock:
+        result = api.search_gzh_info(account_id)
     return flask.jsonify(result)
 
 
@@ -174,7 +181,8 @@ def search_account_by_id(account_id):
 def search_article_by_keywords(keywords):
     keywords = keywords.encode('UTF-8')
     api = sogou_api.get_wx_api()
-    result = api.search_article_info(keywords)
+    with sogou_api.lock:
+        result = api.search_article_info(keywords)
     return flask.jsonify(result)
 
 
@@ -183,7 +191,8 @@ def search_article_by_keywords(keywords):
 def search_message_by_id(account_id):
     account_id = account_id.encode('UTF-8')
     api = sogou_api.get_wx_api()
-    result = api.get_gzh_message(wechatid=account_id)
+    with sogou_api.lock:
+        result = api.get_gzh_message(wechatid=account_id)
     return flask.jsonify(result)
 
 
@@ -198,7 +207,7 @@ def add_wxid(wxid):
     if not common.is_wxid(wxid):
         return get_error_response('cannot solve this id').format()
     try:
-        sqlite_helper.subscribe(wxid)
+        get_thread_storage().subscribe(wxid)
         return get_success_response().format()
     except Exception as e:
         return get_error_response(e.message).format()
@@ -209,7 +218,7 @@ def batch_wxid():
     data = request.data
     lst = json.loads(data)
     if isinstance(lst, list):
-        sqlite_helper.batch_subscribe(lst)
+        get_thread_storage().batch_subscribe(lst)
         return get_success_response().format()
     else:
         return get_error_response(data + 'is not a list').format()
@@ -218,13 +227,20 @@ def batch_wxid():
 @app.route('/rest/exid/remove/<wxid>')
 def remove_wxid(wxid):
     wxid = wxid.strip()
-    sqlite_helper.unsubscribe(wxid)
+    get_thread_storage().unsubscribe(wxid)
     return get_success_response().format()
 
 
 @app.route('/rest/status')
 def get_status():
-    return ResponseBody(1, download_queue.get_status()).format()
+    return ResponseBody(1, download_queue.get_status(),
+                        session_pool=session_pool.get_pool().stats(),
+                        browser_pool=botdriver.get_pool().stats(),
+                        escalation=hybrid.get_stats().stats(),
+                        circuit_breakers=circuit_breaker.get_states(),
+                        writer=writer.get_stats(),
+                        retry_queue=download_queue.get_retry_queue_depth(),
+                        running_jobs=len(download_queue.get_manager().running())).format()
 
 
 @app.route('/start')
@@ -259,11 +275,64 @@ def get_log(line):
     return ResponseBody(log=l).format()
 
 
+@app.route('/rest/jobs', methods=['GET'])
+def list_jobs():
+    return ResponseBody(jobs=[t.get_info() for t in download_queue.get_manager().list()]).format()
+
+
+@app.route('/rest/jobs', methods=['POST'])
+def create_job():
+    """请求体是微信号列表的json，例如["wxid1", "wxid2"]，和正在进行的其他抓取同时进行
+
+    ?timeout=秒数 抓取开始后多少秒停止，默认为config.job_deadline
+    """
+    try:
+        wxid_list = json.loads(request.data)
+    except ValueError:
+        return get_error_response('%s is not json' % request.data).format()
+    if not isinstance(wxid_list, list) or not wxid_list:
+        return get_error_response('%s is not a list' % request.data).format()
+    invalid = [w for w in wxid_list if not isinstance(w, basestring) or not common.is_wxid(w)]
+    if invalid:
+        return get_error_response('cannot solve these ids: %s' % ', '.join('%s' % w for w in invalid)).format()
+    timeout = request.args.get('timeout', type=int)
+    thread = download_queue.get_manager().create(wxid_list, timeout=timeout)
+    return ResponseBody(job=thread.get_info()).format()
+
+
+@app.route('/rest/jobs/<int:job_id>')
+def get_job(job_id):
+    thread = download_queue.get_manager().get(job_id)
+    if not thread:
+        return get_error_response('job %s not found' % job_id, False).format()
+    return ResponseBody(job=thread.get_info()).format()
+
+
+@app.route('/rest/jobs/<int:job_id>/log/<int:line>')
+def get_job_log(job_id, line):
+    thread = download_queue.get_manager().get(job_id)
+    if not thread:
+        return get_error_response('job %s not found' % job_id, False).format()
+    return ResponseBody(log=thread.log[line:]).format()
+
+
+@app.route('/rest/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not download_queue.get_manager().cancel(job_id):
+        return get_error_response('job %s not found' % job_id, False).format()
+    return get_success_response().format()
+
+
+# 只读的查询在线程池中并发执行(见common.wsgi_container)，/rest/article/search/等会请求搜狗的路由不能放在这里
+READ_ROUTES = ('/rest/article/date/', '/rest/article/author/', '/rest/date/create_at', '/rest/date/written',
+               '/rest/wxid/list')
+
+
 @app.route('/rest/article/date/written/<date>')
 def get_articles_by_date_written(date):
     if not common.valid_date_string(date):
         return get_error_response('%s is not a date' % date).format()
-    articles = sqlite_helper.get_articles_by_date_written(date)
+    articles = get_read_storage().get_articles_by_date_written(date)
     return ResponseBody(articles=articles).format()
 
 
@@ -271,29 +340,29 @@ def get_articles_by_date_written(date):
 def get_articles_by_date_created(date):
     if not common.valid_date_string(date):
         return get_error_response('%s is not a date' % date).format()
-    articles = sqlite_helper.get_articles_by_date_created(date)
+    articles = get_read_storage().get_articles_by_date_created(date)
     return ResponseBody(articles=articles).format()
 
 
 @app.route('/rest/article/author/<author>')
 def get_articles_by_author(author):
-    articles = sqlite_helper.get_articles_by_author(author)
+    articles = get_read_storage().get_articles_by_author(author)
     return ResponseBody(articles=articles).format()
 
 
 @app.route('/rest/date/create_at')
 def get_date_by_created():
-    return ResponseBody(date=sqlite_helper.get_date_by_created()).format()
+    return ResponseBody(date=get_read_storage().get_date_by_created()).format()
 
 
 @app.route('/rest/date/written')
 def get_date_by_written():
-    return ResponseBody(date=sqlite_helper.get_date_by_written()).format()
+    return ResponseBody(date=get_read_storage().get_date_by_written()).format()
 
 
 @app.route('/rest/wxid/list')
 def get_wxid_list():
-    subscribes = sqlite_helper.get_wxid_list()
+    subscribes = get_read_storage().get_wxid_list()
     return ResponseBody(wxid_list=subscribes).format()
 
 
@@ -334,8 +403,8 @@ def proxy_image(url_encoded):
                      'fLdTJ7g-QzBX*tQN6tdMxEYkozcYimHAinkncfvFVB3KMmQnUX1A--C-pwfyIHSDWaax279QqOwZO*'
                      '*cpZvLg*nYFo27AYt5duA4f4JdlVpMsc='
     }
-    resp = requests.get(url, headers=headers, stream=True)
-    return resp.raw.read(), resp.status_code, resp.headers.items()
+    resp = requests.get(url, headers=headers, stream=True, timeout=deadline.get_timeout())
+    return deadline.read_body(resp, raw=True), resp.status_code, resp.headers.items()
 
 
 @app.route('/vcode/img/')
@@ -351,16 +420,12 @@ def get_vcode_img():
 # only for test
 @app.route('/save')
 def save_page():
-    subscribes = sqlite_helper.get_wxid_list()
+    subscribes = get_read_storage().get_wxid_list()
     print(subscribes)
     try:
-        info_list = list()
         for s in subscribes:
             print("processing wxid=%s" % s['name'])
-            all_articles = sogou_api.get_articles_by_id(s['name'])
-            for a in all_articles:
-                info_list.append(a)
-            download_queue.resolve(info_list)
+            download_queue.resolve(sogou_api.get_articles_by_id(s['name']))
         return get_success_response().format()
     except Exception as e:
         return get_error_response(e.message).format()
@@ -380,6 +445,6 @@ if __name__ == '__main__':
     handler = RotatingFileHandler(_get_log_path(), maxBytes=100000, backupCount=1)
     handler.setLevel(logging.DEBUG)
     app.logger.addHandler(handler)
-    http_server = HTTPServer(WSGIContainer(app))
+    http_server = HTTPServer(ThreadedWSGIContainer(app, config.http_read_threads, READ_ROUTES))
     http_server.listen(config.http_port)
     IOLoop.instance().start()
@@ -3,21 +3,84 @@ import hashlib
 import json
 import re
 import sqlite3
+import threading
 import time
 import datetime
 
 import common
+import config
 from storage import db
 
 version = '1.0'
 
+# download_job.state
+JOB_PENDING = 'pending'
+# 已经放进下载队列，还没有开始下载，没有lease，只会被release_jobs放回pending
+JOB_QUEUED = 'queued'
+JOB_IN_FLIGHT = 'in_flight'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# 数据库结构的版本，保存在PRAGMA user_version中，每个版本对应SQLiteStorage._migrate_v<版本>
+SCHEMA_VERSION = 3
+
+# 按条件查询文章和下载任务的语句，_explain会检查它们的查询计划都用到了索引
+_queries = {
+    'articles_by_date_created': "SELECT * FROM article WHERE created_day=date(?)",
+    'articles_by_date_written': "SELECT * FROM article WHERE date_time=?",
+    'articles_by_author': "SELECT * FROM article WHERE author=?",
+    'date_by_created': "SELECT created_day FROM article WHERE created_day>=? GROUP BY created_day",
+    'date_by_written': "SELECT date_time FROM article WHERE date_time>=? GROUP BY date_time",
+    'claim_jobs': "SELECT * FROM download_job WHERE run_id=?"
+                  " AND ((state=? AND (not_before IS NULL OR not_before<=?))"
+                  " OR (state=? AND lease_until<?)) LIMIT ?",
+    'next_retry': "SELECT min(not_before) FROM download_job WHERE run_id=? AND state=? AND attempts>0",
+    'count_retry_jobs': "SELECT count(*) FROM download_job WHERE run_id=? AND state=? AND attempts>0",
+    'count_jobs': "SELECT state, count(*) FROM download_job WHERE run_id=? GROUP BY state",
+    'requeue_jobs': "UPDATE download_job SET run_id=?, state=?, lease_until=NULL, attempts=0, error=NULL,"
+                    " not_before=NULL WHERE wxid=? AND run_id!=? AND (state=? OR (state!=? AND EXISTS"
+                    " (SELECT 1 FROM crawl_run WHERE id=download_job.run_id AND finished_at IS NOT NULL)))",
+}
+
+_local = threading.local()
+
+
+def get_thread_storage():
+    """取得当前线程专用的SQLiteStorage，sqlite3的连接不能跨线程使用
+    """
+    helper = getattr(_local, 'helper', None)
+    if helper is None:
+        helper = SQLiteStorage()
+        _local.helper = helper
+    return helper
+
+
+def get_read_storage():
+    """取得当前线程专用的只读SQLiteStorage，用于REST接口的查询
+
+    WAL模式下读连接不会被抓取的写入阻塞，不同线程的查询也可以同时进行
+    """
+    reader = getattr(_local, 'reader', None)
+    if reader is None:
+        reader = SQLiteStorage(read_only=True)
+        _local.reader = reader
+    return reader
+
 
 class SQLiteStorage:
 
-    def __init__(self):
-        self._connect = sqlite3.connect(db)
+    def __init__(self, read_only=False, path=None):
+        """
+
+        :param read_only: 为True时连接设置query_only，调用写入的方法会抛出sqlite3.OperationalError
+        :param path: 数据库文件，默认为storage.db
+        """
+        self._connect = sqlite3.connect(path or db)
         self._connect.text_factory = str
+        self._tune()
         self._create_table()
+        if read_only:
+            self._connect.execute("PRAGMA query_only=ON")
 
     def subscribe(self, wxid):
         c = self._connect.cursor()
@@ -43,7 +106,8 @@ class SQLiteStorage:
             p = (i, )
             data.append(p)
         try:
-            c.executemany("INSERT OR REPLACE INTO wxid(name) VALUES (?)", data)
+            # 已经订阅的微信号保留水印、lease和抓取时间
+            c.executemany("INSERT OR IGNORE INTO wxid(name) VALUES (?)", data)
             self._connect.commit()
         except Exception as e:
             print(e)
@@ -83,20 +147,104 @@ class SQLiteStorage:
         result_list.reverse()
         return result_list
 
-    def insert_article(self, article, local_url, author_name=''):
+    def get_watermark(self, wxid):
+        """
+
+        :return: 上次抓取到的最新消息(datetime, qunfa_id)，没有抓取过时返回None
+        """
         c = self._connect.cursor()
-        m = hashlib.md5()
-        m.update(article['title'])
-        hash_id = m.hexdigest()
-        date_time = time.localtime(int(article['datetime']))
-        date_time = time.strftime("%Y-%m-%d", date_time)
-        extra = json.dumps(article)
-        data = (hash_id, date_time, article['title'], "", extra, local_url, version, author_name)
-        c.execute("""INSERT INTO article(hash_id, date_time, title, info, extra, content, version, author)
-                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", data)
+        result = c.execute("SELECT last_datetime, last_qunfa_id FROM wxid WHERE name=?", [wxid]).fetchone()
+        c.close()
+        if not result or result[0] is None:
+            return None
+        return result[0], result[1] or 0
+
+    def claim_wxids(self, owner, limit, lease, interval):
+        """worker领取一批微信号，lease秒内没有续约或释放的微信号可以被其他worker领取
+
+        :param owner: worker id
+        :param interval: 距离上次抓取完成不到interval秒的微信号不会被领取
+        :return: list of str 领取到的微信号，最久没有抓取的在前
+        """
+        now = time.time()
+        c = self._connect.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            result = c.execute("SELECT name FROM wxid"
+                               " WHERE (lease_until IS NULL OR lease_until<?)"
+                               " AND (crawled_at IS NULL OR crawled_at<?)"
+                               " ORDER BY crawled_at LIMIT ?", [now, now - interval, limit]).fetchall()
+            names = [r[0] for r in result]
+            c.executemany("UPDATE wxid SET lease_owner=?, lease_until=? WHERE name=?",
+                          [(owner, now + lease, n) for n in names])
+            self._connect.commit()
+        except Exception:
+            self._connect.rollback()
+            raise
+        finally:
+            c.close()
+        return names
+
+    def renew_wxid_lease(self, owner, names, lease):
+        """
+
+        :return: list of str 续约成功的微信号，lease过期后被其他worker领取的不在其中
+        """
+        renewed = list()
+        c = self._connect.cursor()
+        for n in names:
+            c.execute("UPDATE wxid SET lease_until=? WHERE name=? AND lease_owner=?", [time.time() + lease, n, owner])
+            if c.rowcount:
+                renewed.append(n)
+        self._connect.commit()
+        c.close()
+        return renewed
+
+    def release_wxids(self, owner, names, crawled=True):
+        """
+
+        :param crawled: 是否已经抓取完成，为False时只释放不记录抓取时间
+        """
+        now = time.time()
+        c = self._connect.cursor()
+        if crawled:
+            c.executemany("UPDATE wxid SET lease_owner=NULL, lease_until=NULL, crawled_at=?"
+                          " WHERE name=? AND lease_owner=?", [(now, n, owner) for n in names])
+        else:
+            c.executemany("UPDATE wxid SET lease_owner=NULL, lease_until=NULL"
+                          " WHERE name=? AND lease_owner=?", [(n, owner) for n in names])
         self._connect.commit()
         c.close()
 
+    def insert_article(self, article, local_url, author_name=''):
+        self.insert_articles([(article, local_url, author_name)])
+
+    def insert_articles(self, articles, finished_jobs=()):
+        """在一个事务中写入多篇文章，并把对应的下载任务标记为完成，见storage.writer
+
+        :type articles: list of (article, local_url, author_name) 参数同insert_article
+        :param finished_jobs: 下载任务的hash_id
+        """
+        data = list()
+        for article, local_url, author_name in articles:
+            m = hashlib.md5()
+            m.update(article['title'])
+            date_time = time.strftime("%Y-%m-%d", time.localtime(int(article['datetime'])))
+            data.append((m.hexdigest(), date_time, article['title'], "", json.dumps(article), local_url, version,
+                         author_name))
+        c = self._connect.cursor()
+        try:
+            c.executemany("""INSERT OR IGNORE INTO article(hash_id, date_time, title, info, extra, content, version,
+                          author, created_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, date('now', 'localtime'))""", data)
+            c.executemany("UPDATE download_job SET state=?, lease_until=NULL, error=NULL WHERE hash_id=?",
+                          [(JOB_DONE, hash_id) for hash_id in finished_jobs])
+            self._connect.commit()
+        except Exception:
+            self._connect.rollback()
+            raise
+        finally:
+            c.close()
+
     def get_article(self, hash_id):
         c = self._connect.cursor()
         result = c.execute("SELECT * FROM article WHERE hash_id=?", [hash_id]).fetchone()
@@ -106,10 +254,15 @@ class SQLiteStorage:
         else:
             return ArticleRecord(result)
 
+    def get_article_ids(self):
+        c = self._connect.cursor()
+        result = c.execute("SELECT hash_id FROM article").fetchall()
+        c.close()
+        return [r[0] for r in result]
+
     def get_articles_by_date_created(self, date):
         c = self._connect.cursor()
-        result = c.execute("SELECT * FROM article"
-                           " WHERE created_at BETWEEN date(?) AND date(?, '+1 day')", [date, date]).fetchall()
+        result = c.execute(_queries['articles_by_date_created'], [date]).fetchall()
         articles = list()
         for r in result:
             articles.append(ArticleRecord(r))
@@ -118,7 +271,7 @@ class SQLiteStorage:
 
     def get_articles_by_date_written(self, date):
         c = self._connect.cursor()
-        result = c.execute("SELECT * FROM article WHERE date_time=?", [date]).fetchall()
+        result = c.execute(_queries['articles_by_date_written'], [date]).fetchall()
         articles = list()
         for r in result:
             articles.append(ArticleRecord(r))
@@ -127,7 +280,7 @@ class SQLiteStorage:
 
     def get_articles_by_author(self, author):
         c = self._connect.cursor()
-        result = c.execute("SELECT * FROM article WHERE author=?", [author]).fetchall()
+        result = c.execute(_queries['articles_by_author'], [author]).fetchall()
         articles = list()
         for r in result:
             articles.append(ArticleRecord(r))
@@ -135,34 +288,245 @@ class SQLiteStorage:
         return articles
 
     def get_date_by_created(self):
-        d = datetime.datetime.now()
-        offset = datetime.timedelta(days=7)
-        day = d - offset
-        date_from = datetime.datetime(day.year, day.month, day.day, 0, 0, 0)
-        date = str(date_from)
-        c = self._connect.cursor()
-        result = c.execute("SELECT strftime('%Y-%m-%d', created_at) FROM article"
-                           " WHERE datetime(created_at)>=datetime(?)"
-                           " GROUP BY strftime('%Y-%m-%d', created_at)", [date]).fetchall()
-        return result
+        """
+
+        :return: 最近7天中有文章入库的日期
+        """
+        return self._get_recent_dates(_queries['date_by_created'])
 
     def get_date_by_written(self):
-        d = datetime.datetime.now()
-        offset = datetime.timedelta(days=7)
-        day = d - offset
-        date_from = datetime.datetime(day.year, day.month, day.day, 0, 0, 0)
-        date = str(date_from)
-        c = self._connect.cursor()
-        result = c.execute("SELECT strftime('%Y-%m-%d', date_time) FROM article"
-                           " WHERE datetime(date_time)>=datetime(?)"
-                           " GROUP BY strftime('%Y-%m-%d', date_time)", [date]).fetchall()
+        """
+
+        :return: 最近7天中有文章发布的日期
+        """
+        return self._get_recent_dates(_queries['date_by_written'])
+
+    def _get_recent_dates(self, query):
+        # created_day和date_time都是YYYY-MM-DD，直接比较字符串，可以使用索引
+        date = str(datetime.date.today() - datetime.timedelta(days=7))
+        c = self._connect.cursor()
+        result = c.execute(query, [date]).fetchall()
+        c.close()
         return result
 
+    def create_run(self, wxid_list, owner=None):
+        """新建一次抓取
+
+        :param wxid_list: list of str 本次要抓取的微信号
+        :param owner: 执行抓取的worker id，为None时是service.py中的抓取
+        :return: run id
+        """
+        c = self._connect.cursor()
+        c.execute("INSERT INTO crawl_run(wxid_list, owner) VALUES (?, ?)", [json.dumps(wxid_list), owner])
+        run_id = c.lastrowid
+        self._connect.commit()
+        c.close()
+        return run_id
+
+    def get_unfinished_run(self, owner=None):
+        """
+
+        :param owner: 同create_run
+        :return: owner最近一次没有完成的抓取 dict {"id": run id, "wxid_list": 微信号列表}，没有则返回None
+        """
+        c = self._connect.cursor()
+        result = c.execute("SELECT id, wxid_list FROM crawl_run WHERE finished_at IS NULL AND owner IS ?"
+                           " ORDER BY id DESC LIMIT 1", [owner]).fetchone()
+        c.close()
+        if not result:
+            return None
+        return {'id': result[0], 'wxid_list': json.loads(result[1])}
+
+    def finish_run(self, run_id):
+        c = self._connect.cursor()
+        c.execute("UPDATE crawl_run SET finished_at=datetime('now', 'localtime') WHERE id=?", [run_id])
+        self._connect.commit()
+        c.close()
+
+    def get_listed_wxids(self, run_id):
+        """
+
+        :return: 本次抓取中已经取得过文章列表的微信号
+        """
+        c = self._connect.cursor()
+        result = c.execute("SELECT wxid FROM crawl_listed WHERE run_id=?", [run_id]).fetchall()
+        c.close()
+        return set(r[0] for r in result)
+
+    def enqueue_jobs(self, run_id, wxid, articles, watermark=None):
+        """把一个微信号的文章加入下载队列，记录这个微信号已经取得过列表并更新水印，在同一个事务中完成
+
+        水印在文章进入队列时就已经越过了它们，以前失败的任务和已经结束(或被取消)的抓取中没有下载的任务
+        不会再出现在文章列表中，这里把它们放回本次抓取重新下载。
+        同时进行的抓取(或其他worker)从同一个水印取得同一个微信号的列表时，已经属于其他没有结束的抓取的任务不会被抢过来，
+        水印也只会前进，不会被较早的列表改回去
+
+        :type articles: list of dict 同DownloadTask的info
+        :param watermark: 取得的列表中最新的(datetime, qunfa_id)
+        :return: 放回本次抓取的以前的任务数
+        """
+        data = list()
+        for a in articles:
+            m = hashlib.md5()
+            m.update(a['title'])
+            data.append((m.hexdigest(), run_id, wxid, json.dumps(a), JOB_PENDING))
+        c = self._connect.cursor()
+        c.execute(_queries['requeue_jobs'], [run_id, JOB_PENDING, wxid, run_id, JOB_FAILED, JOB_DONE])
+        requeued = c.rowcount
+        c.executemany("INSERT OR IGNORE INTO download_job(hash_id, run_id, wxid, info, state)"
+                      " VALUES (?, ?, ?, ?, ?)", data)
+        c.execute("INSERT OR IGNORE INTO crawl_listed(run_id, wxid) VALUES (?, ?)", [run_id, wxid])
+        if watermark:
+            c.execute("UPDATE wxid SET last_datetime=?, last_qunfa_id=? WHERE name=? AND (last_datetime IS NULL"
+                      " OR last_datetime<? OR (last_datetime=? AND ifnull(last_qunfa_id, 0)<?))",
+                      [watermark[0], watermark[1], wxid, watermark[0], watermark[0], watermark[1]])
+        self._connect.commit()
+        c.close()
+        return requeued
+
+    def claim_jobs(self, run_id, limit=-1):
+        """领取待下载的任务放进下载队列，lease过期的任务也会被重新领取
+
+        领取的任务标记为queued，在队列中等待多久都不会被再次领取，开始下载时由start_job设置lease
+
+        :return: list of JobRecord
+        """
+        now = time.time()
+        c = self._connect.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            result = c.execute(_queries['claim_jobs'],
+                               [run_id, JOB_PENDING, now, JOB_IN_FLIGHT, now, limit]).fetchall()
+            jobs = [JobRecord(r) for r in result]
+            c.executemany("UPDATE download_job SET state=?, lease_until=NULL WHERE hash_id=?",
+                          [(JOB_QUEUED, j['hash_id']) for j in jobs])
+            self._connect.commit()
+        except Exception:
+            self._connect.rollback()
+            raise
+        finally:
+            c.close()
+        return jobs
+
+    def start_job(self, hash_id, lease):
+        """开始下载从队列中取出的任务，lease秒内没有完成的任务会被claim_jobs重新领取
+
+        :return: 任务不是queued状态(例如已经被release_jobs放回)时返回False，不应该下载
+        """
+        c = self._connect.cursor()
+        c.execute("UPDATE download_job SET state=?, lease_until=?, attempts=attempts+1 WHERE hash_id=? AND state=?",
+                  [JOB_IN_FLIGHT, time.time() + lease, hash_id, JOB_QUEUED])
+        started = c.rowcount == 1
+        self._connect.commit()
+        c.close()
+        return started
+
+    def finish_job(self, hash_id):
+        self._set_job_state(hash_id, JOB_DONE)
+
+    def fail_job(self, hash_id, error=''):
+        self._set_job_state(hash_id, JOB_FAILED, error)
+
+    def retry_job(self, hash_id, error, not_before):
+        """把失败的任务放回队列，not_before(时间戳)之前不会被领取
+        """
+        c = self._connect.cursor()
+        c.execute("UPDATE download_job SET state=?, lease_until=NULL, error=?, not_before=? WHERE hash_id=?",
+                  [JOB_PENDING, error, not_before, hash_id])
+        self._connect.commit()
+        c.close()
+
+    def get_next_retry(self, run_id):
+        """
+
+        :return: 最早一个等待重试的任务可以被领取的时间戳，没有则返回None
+        """
+        c = self._connect.cursor()
+        result = c.execute(_queries['next_retry'], [run_id, JOB_PENDING]).fetchone()
+        c.close()
+        return result[0]
+
+    def count_retry_jobs(self, run_id):
+        """
+
+        :return: 等待重试的任务数
+        """
+        c = self._connect.cursor()
+        result = c.execute(_queries['count_retry_jobs'], [run_id, JOB_PENDING]).fetchone()
+        c.close()
+        return result[0]
+
+    def release_jobs(self, run_id):
+        """把进行中和在下载队列中的任务放回队列，用于进程重启后立刻恢复，不必等待lease过期
+        """
+        c = self._connect.cursor()
+        c.execute("UPDATE download_job SET state=?, lease_until=NULL WHERE run_id=? AND state IN (?, ?)",
+                  [JOB_PENDING, run_id, JOB_IN_FLIGHT, JOB_QUEUED])
+        self._connect.commit()
+        c.close()
+
+    def count_jobs(self, run_id):
+        """
+
+        :return: dict {state: 任务数}
+        """
+        c = self._connect.cursor()
+        result = c.execute(_queries['count_jobs'], [run_id]).fetchall()
+        c.close()
+        return dict(result)
+
+    def _set_job_state(self, hash_id, state, error=None):
+        c = self._connect.cursor()
+        c.execute("UPDATE download_job SET state=?, lease_until=NULL, error=? WHERE hash_id=?", [state, error, hash_id])
+        self._connect.commit()
+        c.close()
+
     def close(self):
         self._connect.close()
 
+    def _tune(self):
+        """WAL模式下写入不会阻塞读取，synchronous=NORMAL时提交不再每次fsync，只在checkpoint时fsync
+
+        config.sqlite_wal为False时使用默认的rollback journal和synchronous=FULL，可以放在网络文件系统上
+        """
+        if config.sqlite_wal:
+            self._connect.execute("PRAGMA journal_mode=WAL")
+            self._connect.execute("PRAGMA synchronous=NORMAL")
+        else:
+            self._connect.execute("PRAGMA journal_mode=DELETE")
+        self._connect.execute("PRAGMA cache_size=-%d" % config.sqlite_cache_kb)
+
     def _create_table(self):
+        """建表并把旧版本的数据库依次迁移到SCHEMA_VERSION
+
+        迁移在一个BEGIN IMMEDIATE事务中完成，多个连接同时打开数据库时只有一个会执行迁移
+        """
         c = self._connect.cursor()
+        if c.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            c.close()
+            return
+        # python2的sqlite3在执行CREATE、ALTER之前会自动提交，迁移期间改为自己管理事务
+        isolation_level = self._connect.isolation_level
+        self._connect.isolation_level = None
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                current = c.execute("PRAGMA user_version").fetchone()[0]
+                if current < SCHEMA_VERSION:
+                    self._create_base_tables(c)
+                    for v in range(current + 1, SCHEMA_VERSION + 1):
+                        getattr(self, '_migrate_v%d' % v)(c)
+                    c.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+        finally:
+            self._connect.isolation_level = isolation_level
+            c.close()
+
+    @staticmethod
+    def _create_base_tables(c):
         create_table_article = """CREATE TABLE IF NOT EXISTS article (
         hash_id text PRIMARY KEY,
         date_time text,
@@ -174,10 +538,65 @@ class SQLiteStorage:
         version text,
         author text)"""
         create_table_wxid = "CREATE TABLE IF NOT EXISTS wxid (name text PRIMARY KEY, extra text)"
+        create_table_crawl_run = """CREATE TABLE IF NOT EXISTS crawl_run (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        wxid_list text,
+        created_at text NOT NULL DEFAULT (datetime('now', 'localtime')),
+        finished_at text)"""
+        create_table_crawl_listed = """CREATE TABLE IF NOT EXISTS crawl_listed (
+        run_id integer,
+        wxid text,
+        PRIMARY KEY (run_id, wxid))"""
+        create_table_download_job = """CREATE TABLE IF NOT EXISTS download_job (
+        hash_id text PRIMARY KEY,
+        run_id integer,
+        wxid text,
+        info text,
+        state text NOT NULL,
+        lease_until real,
+        attempts integer NOT NULL DEFAULT 0,
+        error text)"""
         c.execute(create_table_article)
         c.execute(create_table_wxid)
-        self._connect.commit()
-        c.close()
+        c.execute(create_table_crawl_run)
+        c.execute(create_table_crawl_listed)
+        c.execute(create_table_download_job)
+
+    def _migrate_v1(self, c):
+        """没有版本号之前陆续增加的字段，旧数据库中可能已经有其中一部分
+        """
+        self._add_column(c, 'download_job', 'not_before', 'real')
+        self._add_column(c, 'crawl_run', 'owner', 'text')
+        self._add_column(c, 'wxid', 'lease_owner', 'text')
+        self._add_column(c, 'wxid', 'lease_until', 'real')
+        self._add_column(c, 'wxid', 'crawled_at', 'real')
+        self._add_column(c, 'wxid', 'last_datetime', 'integer')
+        self._add_column(c, 'wxid', 'last_qunfa_id', 'integer')
+
+    def _migrate_v2(self, c):
+        """按日期、作者查询文章和按run_id查询下载任务的索引
+
+        created_day是created_at的日期部分，按入库日期查询时不必对每一行调用date()，可以使用索引
+        """
+        self._add_column(c, 'article', 'created_day', 'text')
+        c.execute("UPDATE article SET created_day=substr(created_at, 1, 10) WHERE created_day IS NULL")
+        c.execute("CREATE INDEX IF NOT EXISTS article_created_day ON article(created_day)")
+        c.execute("CREATE INDEX IF NOT EXISTS article_date_time ON article(date_time)")
+        c.execute("CREATE INDEX IF NOT EXISTS article_author ON article(author)")
+        c.execute("CREATE INDEX IF NOT EXISTS download_job_run_state ON download_job(run_id, state)")
+
+    def _migrate_v3(self, c):
+        """enqueue_jobs按微信号查找以前没有完成的任务
+        """
+        c.execute("CREATE INDEX IF NOT EXISTS download_job_wxid ON download_job(wxid)")
+
+    @staticmethod
+    def _add_column(c, table, column, definition):
+        """给旧版本数据库中已经存在的表增加字段
+        """
+        columns = [r[1] for r in c.execute("PRAGMA table_info(%s)" % table).fetchall()]
+        if column not in columns:
+            c.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, definition))
 
 
 class WXIDRecord(dict):
@@ -211,3 +630,52 @@ class ArticleRecord(dict):
             author=row[8],
             **kwargs)
         self['extra'] = json.loads(self['extra'])
+
+
+class JobRecord(dict):
+
+    def __init__(self, row, **kwargs):
+        """
+
+        :param row: 从SELECT * FROM download_job中出来的原始结果
+        """
+        super(JobRecord, self).__init__(
+            hash_id=row[0],
+            run_id=row[1],
+            wxid=row[2],
+            info=json.loads(row[3]),
+            state=row[4],
+            lease_until=row[5],
+            attempts=row[6],
+            error=row[7],
+            not_before=row[8],
+            **kwargs)
+
+
+def _explain():
+    """在临时数据库中检查_queries的查询计划，有全表扫描时抛出AssertionError
+
+    python -m storage.sqlite_storage
+    """
+    import os
+    import shutil
+    import tempfile
+    path = tempfile.mkdtemp()
+    try:
+        storage = SQLiteStorage(path=os.path.join(path, 'explain.db'))
+        failed = list()
+        for name, query in sorted(_queries.items()):
+            plan = [r[-1] for r in storage._connect.execute(
+                "EXPLAIN QUERY PLAN " + query, [None] * query.count('?')).fetchall()]
+            ok = any(p.startswith('SEARCH') for p in plan) and not any(p.startswith('SCAN') for p in plan)
+            print('%-26s %s  %s' % (name, 'ok  ' if ok else 'SCAN', '; '.join(plan)))
+            if not ok:
+                failed.append(name)
+        storage.close()
+        assert not failed, 'queries without index: %s' % ', '.join(failed)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    _explain()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""文章写入线程
+
+下载线程把下载到的文章交给写入线程后就可以继续下载。写入线程用自己的连接，把最多config.writer_batch_size篇文章
+(或者第一篇进入队列后config.writer_flush_interval秒内的文章)写文件后在一个事务中写入article表，
+同时把对应的下载任务标记为完成，每批只提交一次。
+"""
+from __future__ import print_function
+
+import atexit
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import config
+from common import deadline
+
+_stop = object()
+
+
+class _Flush(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class ArticleWriter(threading.Thread):
+
+    def __init__(self):
+        super(ArticleWriter, self).__init__(name='article-writer')
+        self.daemon = True
+        self._queue = queue.Queue(maxsize=config.writer_queue_size)
+        self._db = None
+        self.batches = 0
+        self.written = 0
+
+    def submit(self, document, callback, job_id=None):
+        """队列满时阻塞
+
+        :type document: common.download_task.DownloadedDocument
+        :param callback: 提交后在写入线程中调用callback(success, msg)，msg为'saved'、'skipped'或错误信息
+        :param job_id: 下载任务的hash_id，和文章在同一个事务中标记为完成
+        """
+        self._queue.put((document, callback, job_id))
+
+    def flush(self):
+        """等待调用之前提交的文章全部写入，当前线程有截止时间(见common.deadline)时最多等到截止时间，
+        没有等到的文章仍会由写入线程写入
+
+        :return: 是否已经全部写入
+        """
+        if not self.is_alive():
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        end = deadline.get_deadline()
+        # 不带timeout的wait在python2中不能被KeyboardInterrupt打断
+        while not marker.event.wait(1 if end is None else max(0, min(1, end - time.time()))):
+            if not self.is_alive() or (end is not None and time.time() >= end):
+                return False
+        return True
+
+    def stop(self):
+        """写完队列中的文章后结束
+        """
+        if self.is_alive():
+            self._queue.put(_stop)
+            self.join()
+
+    def run(self):
+        from storage.sqlite_storage import SQLiteStorage
+        self._db = SQLiteStorage()
+        try:
+            while True:
+                batch = self._next_batch()
+                self._write([i for i in batch if isinstance(i, tuple)])
+                for item in batch:
+                    if isinstance(item, _Flush):
+                        item.event.set()
+                if _stop in batch:
+                    return
+        finally:
+            self._db.close()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        flush_at = time.time() + config.writer_flush_interval
+        while len(batch) < config.writer_batch_size and isinstance(batch[-1], tuple):
+            left = flush_at - time.time()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, items):
+        if not items:
+            return
+        rows = list()
+        jobs = list()
+        results = list()
+        ids = set()
+        for document, callback, job_id in items:
+            article_id = document.get_article_id()
+            try:
+                if article_id in ids or self._db.get_article(article_id) is not None:
+                    results.append((callback, True, 'skipped'))
+                else:
+                    rows.append((document.download_info, document.write_to_file(), document.get_author()))
+                    ids.add(article_id)
+                    results.append((callback, True, 'saved'))
+                if job_id:
+                    jobs.append(job_id)
+            except Exception as e:
+                print(traceback.format_exc())
+                results.append((callback, False, str(e)))
+        try:
+            self._db.insert_articles(rows, jobs)
+            self.batches += 1
+            self.written += len(rows)
+        except Exception as e:
+            print(traceback.format_exc())
+            results = [(callback, False, str(e)) for callback, _, _ in results]
+        for callback, success, msg in results:
+            try:
+                callback(success, msg)
+            except Exception:
+                print(traceback.format_exc())
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'written': self.written,
+        }
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def get_writer():
+    """
+
+    :rtype: ArticleWriter 第一次调用时启动
+    """
+    global _writer
+    with _lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = ArticleWriter()
+            _writer.start()
+        return _writer
+
+
+def flush():
+    """没有启动写入线程时直接返回
+
+    :return: 是否已经全部写入，见ArticleWriter.flush
+    """
+    if _writer:
+        return _writer.flush()
+    return True
+
+
+def get_stats():
+    """
+
+    :return: 写入线程的统计，用于/rest/status，没有启动时返回None
+    """
+    return _writer.stats() if _writer else None
+
+
+def _close():
+    if _writer:
+        _writer.stop()
+
+
+atexit.register(_close)
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import re
-import traceback
 
 import requests
 import time
 from lxml import etree
 
 import common
+import htmlparser
+from common import payload
 from .basic import WechatSogouBasic
 from .exceptions import *
 
@@ -38,51 +39,28 @@ class WechatSogouApi(WechatSogouBasic):
             qr_codes: 二维码
             img: 头像图片
             url: 最近文章地址
+            last_time: 最近一篇文章的发布时间，10位时间戳，页面中没有时为0
         """
 
         text = self._search_gzh_text(name, page)
+        return self._deal_search_gzh_text(text)
+
+    def _deal_search_gzh_text(self, text):
+        """解析搜索公众号返回的文本
+
+        Args:
+            text: 搜索结果页文本
+
+        Returns:
+            同search_gzh_info
+        """
         try:
-            page = etree.HTML(text)
-            lis = page.xpath('//ul[@class="news-list2"]/li')
-            if not lis:
-                common.save_raw_error_log(text, traceback.format_exc())
-            relist = []
-            for li in lis:
-                url = li.xpath('div/div[1]/a/@href')
-                img = li.xpath('div/div[1]/a/img/@src')
-                name = self._get_elem_text(li.xpath('div/div[2]/p[1]')[0])
-                info = self._get_elem_text(li.xpath('div/div[2]/p[2]')[0])
-                info = re.split('微信号:|月发文|篇|平均阅读', info)
-                try:
-                    wechatid = info[1]
-                except IndexError:
-                    wechatid = ''
-                try:
-                    post_perm = int(info[2])
-                except IndexError:
-                    post_perm = 0
-                try:
-                    read_count = int(info[4])
-                except IndexError:
-                    read_count = 0
-                qrcode = li.xpath('div/div[3]/span/img[1]/@src')
-                jieshao = self._get_elem_text(li.xpath('dl[1]/dd')[0])
-                renzhen = li.xpath('dl[2]/dd/text()')
-                relist.append({
-                    'url': url[0],
-                    'img': img[0],
-                    'name': name.replace('red_beg', '').replace('red_end', ''),
-                    'wechatid': wechatid,
-                    'post_perm': post_perm,
-                    'read_count': read_count,
-                    'qrcode': qrcode[0] if qrcode else '',
-                    'jieshao': jieshao.replace('red_beg', '').replace('red_end', ''),
-                    'renzhen': renzhen[0] if renzhen else ''
-                })
-            return relist
+            relist = self._parse(htmlparser.search_gzh_list, text)
         except Exception:
-            common.save_raw_error_log(text, traceback.format_exc())
             raise WechatSogouException()
+        if not relist:
+            common.save_raw_error_log(text)
+        return relist
 
     def get_gzh_info(self, wechatid):
         """获取公众号微信号wechatid的信息
@@ -105,10 +83,9 @@ class WechatSogouApi(WechatSogouBasic):
         info = self.search_gzh_info(wechatid, 1)
         if info:
             info = info[0]
-            from storage.sqlite_storage import SQLiteStorage
+            from storage.sqlite_storage import get_thread_storage
             from common import download_queue
-            helper = SQLiteStorage()
-            helper.edit_extra(wechatid, info)
+            get_thread_storage().edit_extra(wechatid, info)
             download_queue.log_to_bot_process(msg='wxid: %s information updated' % wechatid)
             return info
         else:
@@ -134,54 +111,7 @@ class WechatSogouApi(WechatSogouBasic):
 
         """
         text = self._search_article_text(name, page)
-        page = etree.HTML(text)
-        img = list()
-        info_imgs = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[1]/a/img")
-        for info_img in info_imgs:
-            img.append(info_img.attrib['src'])
-        url = list()
-        info_urls = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[2]/h4/a")
-        for info_url in info_urls:
-            url.append(info_url.attrib['href'])
-        name = list()
-        info_names = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[2]/h4")
-        for info_name in info_names:
-            cache = self._get_elem_text(info_name)
-            cache = cache.replace('red_beg', '').replace('red_end', '')
-            name.append(cache)
-        zhaiyao = list()
-        info_zhaiyaos = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[2]/p")
-        for info_zhaiyao in info_zhaiyaos:
-            cache = self._get_elem_text(info_zhaiyao)
-            cache = cache.replace('red_beg', '').replace('red_end', '')
-            zhaiyao.append(cache)
-        gzhname = list()
-        gzhqrcodes = list()
-        gzhurl = list()
-        info_gzhs = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[2]/div/a")
-        for info_gzh in info_gzhs:
-            gzhname.append(info_gzh.attrib['title'])
-            gzhqrcodes.append(info_gzh.attrib['data-encqrcodeurl'])
-            gzhurl.append(info_gzh.attrib['href'])
-        time = list()
-        info_times = page.xpath(u"//div[@class='wx-rb wx-rb3']/div[2]/div/span/script/text()")
-        for info_time in info_times:
-            time.append(re.findall('vrTimeHandle552write\(\'(.*?)\'\)', info_time)[0])
-        returns = list()
-        for i in range(len(url)):
-            returns.append(
-                {
-                    'name': name[i],
-                    'url': url[i],
-                    'img': img[i],
-                    'zhaiyao': zhaiyao[i],
-                    'gzhname': gzhname[i],
-                    'gzhqrcodes': gzhqrcodes[i],
-                    'gzhurl': gzhurl[i],
-                    'time': time[i]
-                }
-            )
-        return returns
+        return self._parse(htmlparser.search_article_list, text)
 
     def get_gzh_message(self, **kwargs):
         """解析最近文章页  或  解析历史消息记录
@@ -215,7 +145,7 @@ class WechatSogouApi(WechatSogouBasic):
         else:
             raise WechatSogouException('get_gzh_recent_info need param text and url')
 
-        return self._deal_gzh_article_dict(self._get_gzh_article_by_url_dict(text))
+        return self._parse(htmlparser.get_gzh_messages, text)
 
     def get_gzh_message_and_info(self, **kwargs):
         """最近文章页  公众号信息 和 群发信息
@@ -260,7 +190,7 @@ class WechatSogouApi(WechatSogouBasic):
 
         return {
             'gzh_info': self._get_gzh_article_gzh_by_url_dict(text, url),
-            'gzh_messages': self._deal_gzh_article_dict(self._get_gzh_article_by_url_dict(text))
+            'gzh_messages': self._parse(htmlparser.get_gzh_messages, text)
         }
 
     def deal_article_content(self, **kwargs):
@@ -286,7 +216,7 @@ class WechatSogouApi(WechatSogouBasic):
         else:
             raise WechatSogouException('deal_content need param url or text')
 
-        content_html = re.findall(u'<div class="rich_media_content " id="js_content">(.*?)</div>', text, re.S)[0]
+        content_html = self._parse(htmlparser.get_article_content, text)
         # content_rich = re.sub(u'<(?!img|br).*?>', '', content_html)
         # pipei = re.compile(u'<img(.*?)src="(.*?)"(.*?)/>')
         # content_text = pipei.sub(lambda m: '<img src="' + m.group(2) + '" />', content_rich)
@@ -336,7 +266,7 @@ class WechatSogouApi(WechatSogouBasic):
             1] + '&timestamp=' + sg_data[2] + '&signature=' + sg_data[
                               3] + '&uin=&key=&pass_ticket=&wxtoken=&devicetype=&clientversion=0&x5=0'
         comment_text = self._get(comment_req_url, 'get', host='mp.weixin.qq.com', referer='http://mp.weixin.qq.com')
-        comment_dict = eval(comment_text)
+        comment_dict = payload.loads(comment_text)
         ret = comment_dict['base_resp']['ret']
         errmsg = comment_dict['base_resp']['errmsg'] if comment_dict['base_resp']['errmsg'] else 'ret:' + str(ret)
         if ret != 0:
@@ -476,7 +406,7 @@ class WechatSogouApi(WechatSogouBasic):
         text = self._get(url, 'get', host='w.sugg.sogou.com')
         try:
             sugg = re.findall(u'\["' + keyword + '",(.*?),\["', text)[0]
-            sugg = eval(sugg)
+            sugg = payload.loads(sugg)
             return sugg
         except Exception as e:
             logger.error('sugg refind error', e)
@@ -487,8 +417,9 @@ class WechatSogouApi(WechatSogouBasic):
 
         ::param url是抓包获取的历史消息页
         """
+        from common import deadline
         session = requests.session()
-        r = session.get(url, verify=False)
+        r = deadline.request(session, 'get', url, verify=False)
         if r.status_code == requests.codes.ok:
             try:
                 biz = re.findall('biz = \'(.*?)\',', r.text)[0]
@@ -507,6 +438,7 @@ class WechatSogouApi(WechatSogouBasic):
             raise WechatSogouRequestsException('requests status_code error', r.status_code)
 
     def deal_mass_send_msg_page(self, wechatid, updatecache=True):
+        from common import deadline
         url = 'http://mp.weixin.qq.com/mp/getmasssendmsg?'
         uin, key, biz, pass_ticket, frommsgid = self._uinkeybiz(wechatid)
         print([uin, key, biz, pass_ticket, frommsgid])
@@ -528,8 +460,8 @@ class WechatSogouApi(WechatSogouBasic):
 
         try:
             session = self._cache_history_session(wechatid)
-            r = session.get(url, headers={'Host': 'mp.weixin.qq.com'}, verify=False)
-            rdic = eval(r.text)
+            r = deadline.request(session, 'get', url, headers={'Host': 'mp.weixin.qq.com'}, verify=False)
+            rdic = payload.loads(r.text)
             if rdic['ret'] == 0:
 
                 data_dict_from_str = self._str_to_dict(rdic['general_msg_list'])
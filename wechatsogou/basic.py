@@ -5,13 +5,15 @@ import traceback
 import requests
 import random
 import time
-import re
-from lxml import etree
 from PIL import Image
 
-import botdriver
 import common
 import constants
+import htmlparser
+from common import encoding
+from common import payload
+# common中的circuit_breaker、deadline等模块(以及导入它们的botdriver)在顶层导入wechatsogou.exceptions，
+# 这里只能在用到它们的函数中导入，否则先导入其中一个模块时会导入到初始化到一半的模块
 
 try:
     from urllib.request import quote as quote
@@ -70,6 +72,8 @@ class WechatSogouBasic(WechatSogouBase):
         self._cache = WechatCache(config.cache_dir, 60 * 60)
         self._session = self._cache.get(config.cache_session_name) if self._cache.get(
             config.cache_session_name) else requests.session()
+        if config.proxies:
+            self._session.proxies.update(config.proxies)
 
         ocr_config = kwargs.get('ocr_config')
         if ocr_config:
@@ -105,8 +109,7 @@ class WechatSogouBasic(WechatSogouBase):
         Returns:
             对象编码
         """
-        encoding = requests.utils.get_encodings_from_content(r.text)
-        return encoding[0] if encoding else requests.utils.get_encoding_from_headers(r.headers)
+        return encoding.sniff(r.content, r.headers)
 
     def _get_page_by_request(self, url, rtype='get', **kwargs):
         """封装request库get,post方法
@@ -134,35 +137,97 @@ class WechatSogouBasic(WechatSogouBase):
             "Referer": referer if referer else 'http://weixin.sogou.com/',
             'Host': host if host else 'weixin.sogou.com',
         }
+        from common import circuit_breaker, cookie_bridge, deadline, rate_control, rate_limit
+        cookie_bridge.to_session(self._session)
+        circuit_breaker.check(url)
+        rate_limit.acquire(url)
         if rtype == 'get':
-            r = self._session.get(url, headers=headers, **kwargs)
+            r = deadline.request(self._session, 'get', url, headers=headers, **kwargs)
         else:
-            data = kwargs.get('data', None)
-            json = kwargs.get('json', None)
-            r = self._session.post(url, data=data, json=json, headers=headers, **kwargs)
+            r = deadline.request(self._session, 'post', url, headers=headers, **kwargs)
         if r.status_code == requests.codes.ok:
             r.encoding = self._get_encoding_from_response(r)
-            if self._check_vcode(r.text)[0]:
+            # r.text每次访问都会重新解码
+            text = r.text
+            if self._check_vcode(text)[0]:
+                rate_control.on_throttle(url)
                 self._raise_vcode_exception(url)
+            rate_control.on_success(url)
         else:
+            rate_control.on_status(url, r.status_code)
             logger.error('requests status_code error', r.status_code)
             raise WechatSogouRequestsException('requests status_code error', r.status_code)
-        return r.text
+        return text
 
     def _get_page_by_browser(self, url):
-        driver = botdriver.get_driver()
-        driver.get(url)
-        driver.implicitly_wait(10)
-        time.sleep(3)
-        # text = self._replace_html(driver.page_source)
-        text = driver.page_source.encode('utf-8')
+        import botdriver
+        from common import circuit_breaker, cookie_bridge, rate_control, rate_limit
+        circuit_breaker.check(url)
+        pool = botdriver.get_pool()
+        driver = pool.checkout()
+        try:
+            rate_limit.acquire(url)
+            driver.get(url)
+            botdriver.wait_until_ready(driver, url)
+            # text = self._replace_html(driver.page_source)
+            text = driver.page_source.encode('utf-8')
+        except Exception:
+            pool.discard(driver)
+            raise
+        if not self._check_vcode(text)[0]:
+            rate_control.on_success(url)
+            pool.checkin(driver)
+            return text
+        rate_control.on_throttle(url)
+        if pool.lean:
+            # 不加载图片的浏览器无法截取验证码，用完整的浏览器带上requests会话的cookie重新打开，
+            # 解封的就是requests使用的身份
+            pool.checkin(driver)
+            driver = botdriver.get_driver()
+            try:
+                cookie_bridge.from_session(self._session)
+                cookie_bridge.to_driver(driver, url)
+                rate_limit.acquire(url)
+                driver.get(url)
+                botdriver.wait_until_ready(driver, url)
+                text = driver.page_source.encode('utf-8')
+            except Exception:
+                # 这个浏览器不属于浏览器池，交给验证码会话之前出错时要自己结束进程
+                botdriver.quit_driver(driver)
+                raise
+        else:
+            pool.detach(driver)
+        # 验证码会话接管这个driver，由common.vcode.close_session关闭
         if not self.solve_vcode(driver, text):
-            driver.delete_all_cookies()
             raise WechatSogouException('not solved vcode')
+        return text
+
+    def _parse(self, func, text):
+        """解析页面，config.parse_processes大于0时在common.parse_pool的进程池中执行，失败时保存原始页面
+
+        Args:
+            func: 模块级的解析函数，参数是页面文本，例如htmlparser.search_gzh_list
+            text: 页面文本
+
+        Returns:
+            func的返回值
+        """
+        from common import parse_pool
         try:
-            driver.close()
-        except:
-            pass
+            return parse_pool.parse(func, text)
+        except Exception:
+            common.save_raw_error_log(text, traceback.format_exc())
+            raise
+
+    def _get_page_by_checked_request(self, url, **kwargs):
+        """用requests请求，并检查页面内容是否完整
+
+        Raises:
+            WechatSogouParseException: 页面内容需要js生成
+        """
+        from common import hybrid
+        text = self._get_page_by_request(url, **kwargs)
+        hybrid.check_page(url, text)
         return text
 
     def solve_vcode(self, driver, response_text):
@@ -172,22 +237,29 @@ class WechatSogouBasic(WechatSogouBase):
         :param response_text:
         :return: 是否已解决验证码问题
         """
-        from common import vcode
+        from common import cookie_bridge, vcode
         check_vcode, vcode_type = self._check_vcode(response_text)
-        if vcode_type == 1:
-            common.save_raw_error_log(response_text)
-            vcode.create_session(driver, vcode_from=vcode.VCODE_LOCKED_IP)
-        elif vcode_type == 2:
-            # try to solve vcode
-            common.save_raw_error_log(response_text)
-            vcode.create_session(driver)
-        if check_vcode:
-            for i in range(60):
-                time.sleep(1)
-                if vcode.solved:
-                    check_vcode = False
-                    break
-            vcode.close_session()
+        with vcode.lock:
+            if vcode_type == 1:
+                common.save_raw_error_log(response_text)
+                vcode.create_session(driver, vcode_from=vcode.VCODE_LOCKED_IP)
+            elif vcode_type == 2:
+                # try to solve vcode
+                common.save_raw_error_log(response_text)
+                vcode.create_session(driver)
+            if check_vcode:
+                for i in range(60):
+                    time.sleep(1)
+                    if vcode.solved:
+                        check_vcode = False
+                        break
+                if not check_vcode:
+                    # 解封后的cookie交给requests会话，之后不需要浏览器
+                    try:
+                        cookie_bridge.from_driver(driver)
+                    except Exception as e:
+                        logger.error('failed to copy cookies from browser: %s' % e)
+                vcode.close_session()
         return not check_vcode
 
     def _check_vcode(self, response_text):
@@ -207,10 +279,15 @@ class WechatSogouBasic(WechatSogouBase):
         raise WechatSogouVcodeException('weixin.sogou.com verification code')
 
     def _get(self, url, rtype='get', **kwargs):
-        if config.engine == constants.request:
-            return self._get_page_by_request(self, url, rtype=rtype, **kwargs)
-        elif config.engine == constants.browser:
+        from common import hybrid
+        if config.engine == constants.browser:
             return self._get_page_by_browser(url)
+        elif config.engine == constants.hybrid and rtype == 'get':
+            return hybrid.fetch(url, lambda u: self._get_page_by_checked_request(u, **kwargs),
+                                self._get_page_by_browser)
+        else:
+            # constants.coroutine只用于SpiderThread的批量抓取，单次调用仍走requests
+            return self._get_page_by_request(url, rtype=rtype, **kwargs)
 
     def _jiefeng(self):
         """对于出现验证码，识别验证码，解封
@@ -221,9 +298,10 @@ class WechatSogouBasic(WechatSogouBase):
         Raises:
             WechatSogouVcodeException: 解封失败，可能验证码识别失败
         """
+        from common import cookie_bridge, deadline
         logger.debug('vcode appear, using _jiefeng')
         codeurl = 'http://weixin.sogou.com/antispider/util/seccode.php?tc=' + str(time.time())[0:10]
-        coder = self._session.get(codeurl)
+        coder = deadline.request(self._session, 'get', codeurl)
         if hasattr(self, '_ocr'):
             result = self._ocr.create(coder.content, 3060)
             img_code = result['Result']
@@ -243,20 +321,22 @@ class WechatSogouBasic(WechatSogouBase):
             'Referer': 'http://weixin.sogou.com/antispider/?from=%2f' + quote(
                 self._vcode_url.replace('http://', ''))
         }
-        rr = self._session.post(post_url, post_data, headers=headers)
-        remsg = eval(rr.content)
+        rr = deadline.request(self._session, 'post', post_url, data=post_data, headers=headers)
+        remsg = payload.loads(rr.content)
         if remsg['code'] != 0:
             logger.error('cannot jiefeng because ' + remsg['msg'])
             raise WechatSogouVcodeException('cannot jiefeng because ' + remsg['msg'])
         self._cache.set(config.cache_session_name, self._session)
+        cookie_bridge.from_session(self._session)
         print('ocr ', remsg['msg'])
 
     def _ocr_for_get_gzh_article_by_url_text(self, url):
+        from common import cookie_bridge, deadline
         logger.debug('vcode appear, using _ocr_for_get_gzh_article_by_url_text')
         timestr = str(time.time()).replace('.', '')
         timever = timestr[0:13] + '.' + timestr[13:17]
         codeurl = 'http://mp.weixin.qq.com/mp/verifycode?cert=' + timever
-        coder = self._session.get(codeurl)
+        coder = deadline.request(self._session, 'get', codeurl)
         if hasattr(self, '_ocr'):
             result = self._ocr.create(coder.content, 2040)
             img_code = result['Result']
@@ -274,12 +354,13 @@ class WechatSogouBasic(WechatSogouBase):
             'Host': 'mp.weixin.qq.com',
             'Referer': url
         }
-        rr = self._session.post(post_url, post_data, headers=headers)
-        remsg = eval(rr.text)
+        rr = deadline.request(self._session, 'post', post_url, data=post_data, headers=headers)
+        remsg = payload.loads(rr.text)
         if remsg['ret'] != 0:
             logger.error('cannot jiefeng get_gzh_article  because ' + remsg['errmsg'])
             raise WechatSogouVcodeException('cannot jiefeng get_gzh_article  because ' + remsg['errmsg'])
         self._cache.set(config.cache_session_name, self._session)
+        cookie_bridge.from_session(self._session)
         logger.debug('ocr ', remsg['errmsg'])
 
     def _replace_html(self, s):
@@ -304,31 +385,8 @@ class WechatSogouBasic(WechatSogouBase):
         s = s.replace('\\', '')
         return s
 
-    def _replace_dict(self, dicts):
-        retu_dict = dict()
-        for k, v in dicts.items():
-            retu_dict[self._replace_all(k)] = self._replace_all(v)
-        return retu_dict
-
-    def _replace_list(self, lists):
-        retu_list = list()
-        for l in lists:
-            retu_list.append(self._replace_all(l))
-        return retu_list
-
-    def _replace_all(self, data):
-        if isinstance(data, dict):
-            return self._replace_dict(data)
-        elif isinstance(data, list):
-            return self._replace_list(data)
-        elif isinstance(data, str):
-            return self._replace_html(data)
-        else:
-            return data
-
     def _str_to_dict(self, json_str):
-        json_dict = eval(json_str)
-        return self._replace_all(json_dict)
+        return payload.loads(json_str)
 
     def _replace_space(self, s):
         s = s.replace(' ', '')
@@ -349,8 +407,7 @@ class WechatSogouBasic(WechatSogouBase):
         Returns:
             text: 返回的文本
         """
-        request_url = 'http://weixin.sogou.com/weixin?query=' + quote(
-            name) + '&_sug_type_=&_sug_=n&type=1&page=' + str(page) + '&ie=utf8'
+        request_url = self._search_gzh_url(name, page)
         try:
             text = self._get(request_url)
         except WechatSogouVcodeException:
@@ -360,6 +417,10 @@ class WechatSogouBasic(WechatSogouBase):
                                  self._vcode_url.replace('http://', '')))
         return text
 
+    def _search_gzh_url(self, name, page=1):
+        return 'http://weixin.sogou.com/weixin?query=' + quote(
+            name) + '&_sug_type_=&_sug_=n&type=1&page=' + str(page) + '&ie=utf8'
+
     def _search_article_text(self, name, page=1):
         """通过搜狗搜索微信文章关键字返回的文本
         Args:
@@ -413,30 +474,10 @@ class WechatSogouBasic(WechatSogouBase):
             img: 头像图片
             url: 最近文章地址
         """
-        page = etree.HTML(text)
-        profile_info_area = page.xpath("//div[@class='profile_info_area']")[0]
-        img = profile_info_area.xpath('div[1]/span/img/@src')[0]
-        name = profile_info_area.xpath('div[1]/div/strong/text()')[0]
-        name = self._replace_space(name)
-        wechatid = profile_info_area.xpath('div[1]/div/p/text()')
-        if wechatid:
-            wechatid = wechatid[0].replace(u'微信号: ', '')
-        else:
-            wechatid = ''
-        jieshao = profile_info_area.xpath('ul/li[1]/div/text()')[0]
-        renzhen = profile_info_area.xpath('ul/li[2]/div/text()')
-        renzhen = renzhen[0] if renzhen else ''
-        qrcode = page.xpath('//*[@id="js_pc_qr_code_img"]/@src')[0]
-        qrcode = 'http://mp.weixin.qq.com/' + qrcode if qrcode else ''
-        return {
-            'name': name,
-            'wechatid': wechatid,
-            'jieshao': jieshao,
-            'renzhen': renzhen,
-            'qrcode': qrcode,
-            'img': img,
-            'url': url
-        }
+        info = htmlparser.get_gzh_article_gzh_by_url_dict(text, url)
+        info['jieshao'] = info.pop('introduction')
+        info['renzhen'] = info.pop('authentication')
+        return info
 
     def _get_gzh_article_by_url_dict(self, text):
         """最近文章页 文章信息
@@ -447,16 +488,11 @@ class WechatSogouBasic(WechatSogouBase):
         Returns:
             msgdict: 最近文章信息字典
         """
-        msg_list = re.findall("var msgList = (.+?)};", text, re.S)
-        if not msg_list:
-            msg_list = re.findall("var msgList = '(.+?)'};", text, re.S)
-        if not msg_list:
+        try:
+            return htmlparser.get_gzh_article_by_url_dict(text)
+        except ValueError:
             common.save_raw_error_log(text, traceback.format_exc())
             raise Exception('got a wrong page')
-        msg_list = msg_list[0] + '}'
-        msg_dict = eval(msg_list)
-        msg_dict = self._replace_all(msg_dict)
-        return msg_dict
 
     def _deal_gzh_article_dict(self, msgdict, **kwargs):
         """解析 公众号 群发消息
@@ -469,84 +505,7 @@ class WechatSogouBasic(WechatSogouBase):
 
             当type不同时，含有不同的字段，具体见文档
         """
-        biz = kwargs.get('biz', '')
-        uin = kwargs.get('uin', '')
-        key = kwargs.get('key', '')
-        items = list()
-        for listdic in msgdict['list']:
-            item = dict()
-            comm_msg_info = listdic['comm_msg_info']
-            item['qunfa_id'] = comm_msg_info.get('id', '')  # 不可判重，一次群发的消息的id是一样的
-            item['datetime'] = comm_msg_info.get('datetime', '')
-            item['type'] = str(comm_msg_info.get('type', ''))
-            if item['type'] == '1':
-                # 文字
-                item['content'] = comm_msg_info.get('content', '')
-            elif item['type'] == '3':
-                # 图片
-                item[
-                    'img_url'] = 'https://mp.weixin.qq.com/mp/getmediadata?__biz=' + biz + '&type=img&mode=small&msgid=' + \
-                                 str(item['qunfa_id']) + '&uin=' + uin + '&key=' + key
-            elif item['type'] == '34':
-                # 音频
-                item['play_length'] = listdic['voice_msg_ext_info'].get('play_length', '')
-                item['fileid'] = listdic['voice_msg_ext_info'].get('fileid', '')
-                item['audio_src'] = 'https://mp.weixin.qq.com/mp/getmediadata?__biz=' + biz + '&type=voice&msgid=' + \
-                                    str(item['qunfa_id']) + '&uin=' + uin + '&key=' + key
-            elif item['type'] == '49':
-                # 图文
-                app_msg_ext_info = listdic['app_msg_ext_info']
-                url = app_msg_ext_info.get('content_url')
-                if url:
-                    url = 'http://mp.weixin.qq.com' + url if 'http://mp.weixin.qq.com' not in url else url
-                else:
-                    url = ''
-                item['main'] = 1
-                item['title'] = app_msg_ext_info.get('title', '')
-                item['digest'] = app_msg_ext_info.get('digest', '')
-                item['fileid'] = app_msg_ext_info.get('fileid', '')
-                item['content_url'] = url
-                item['source_url'] = app_msg_ext_info.get('source_url', '')
-                item['cover'] = app_msg_ext_info.get('cover', '')
-                item['author'] = app_msg_ext_info.get('author', '')
-                item['copyright_stat'] = app_msg_ext_info.get('copyright_stat', '')
-                items.append(item)
-                if app_msg_ext_info.get('is_multi', 0) == 1:
-                    for multidic in app_msg_ext_info['multi_app_msg_item_list']:
-                        url = multidic.get('content_url')
-                        if url:
-                            url = 'http://mp.weixin.qq.com' + url if 'http://mp.weixin.qq.com' not in url else url
-                        else:
-                            url = ''
-                        itemnew = dict()
-                        itemnew['qunfa_id'] = item['qunfa_id']
-                        itemnew['datetime'] = item['datetime']
-                        itemnew['type'] = item['type']
-                        itemnew['main'] = 0
-                        itemnew['title'] = multidic.get('title', '')
-                        itemnew['digest'] = multidic.get('digest', '')
-                        itemnew['fileid'] = multidic.get('fileid', '')
-                        itemnew['content_url'] = url
-                        itemnew['source_url'] = multidic.get('source_url', '')
-                        itemnew['cover'] = multidic.get('cover', '')
-                        itemnew['author'] = multidic.get('author', '')
-                        itemnew['copyright_stat'] = multidic.get('copyright_stat', '')
-                        items.append(itemnew)
-                continue
-            elif item['type'] == '62':
-                item['cdn_videoid'] = listdic['video_msg_ext_info'].get('cdn_videoid', '')
-                item['thumb'] = listdic['video_msg_ext_info'].get('thumb', '')
-                item['video_src'] = 'https://mp.weixin.qq.com/mp/getcdnvideourl?__biz=' + biz + '&cdn_videoid=' + item[
-                    'cdn_videoid'] + '&thumb=' + item['thumb'] + '&uin=' + uin + '&key=' + key
-            items.append(item)
-
-        items_new = []  # 删除搜狗本身携带的空数据
-        for item in items:
-            if (int(item['type']) == 49) and (not item['content_url']):
-                pass
-            else:
-                items_new.append(item)
-        return items_new
+        return htmlparser._deal_gzh_article_dict(msgdict, **kwargs)
 
     def _get_gzh_article_text(self, url):
         """获取文章文本
@@ -577,7 +536,7 @@ class WechatSogouBasic(WechatSogouBase):
                           + '&title=' + title \
                           + '&uin=&key=&pass_ticket=&wxtoken=&devicetype=&clientversion=0&x5=0'
         related_text = self._get(related_req_url, 'get', host='mp.weixin.qq.com', referer=url)
-        related_dict = eval(related_text)
+        related_dict = payload.loads(related_text)
         ret = related_dict['base_resp']['ret']
         errmsg = related_dict['base_resp']['errmsg'] if related_dict['base_resp']['errmsg'] else 'ret:' + str(ret)
         if ret != 0:
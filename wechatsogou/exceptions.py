@@ -43,10 +43,37 @@ class ConfigException(WechatSogouException):
     pass
 
 
+class WechatSogouParseException(WechatSogouException):
+    """基于搜狗搜索的的微信公众号爬虫接口 页面解析失败 异常类
+    """
+    pass
+
+
 class WechatSogouRequestsException(WechatSogouException):
     """基于搜狗搜索的的微信公众号爬虫接口 抓取 异常类
     """
 
     def __init__(self, errmsg, status_code):
-        WechatSogouException(errmsg)
+        super(WechatSogouRequestsException, self).__init__('%s: %s' % (errmsg, status_code))
         self.status_code = status_code
+
+
+class WechatSogouDeadlineException(WechatSogouException):
+    """基于搜狗搜索的的微信公众号爬虫接口 超过抓取的截止时间 异常类
+    """
+    pass
+
+
+class WechatSogouResponseTooLargeException(WechatSogouException):
+    """基于搜狗搜索的的微信公众号爬虫接口 响应体超过大小上限 异常类
+    """
+
+    def __init__(self, url, size):
+        super(WechatSogouResponseTooLargeException, self).__init__('%s response too large: %s bytes' % (url, size))
+        self.size = size
+
+
+class WechatSogouCircuitOpenException(WechatSogouException):
+    """基于搜狗搜索的的微信公众号爬虫接口 接口熔断中 异常类
+    """
+    pass
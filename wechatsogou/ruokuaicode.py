@@ -3,6 +3,7 @@
 import requests
 from hashlib import md5
 
+import config
 from .base import WechatSogouBase
 
 
@@ -35,7 +36,9 @@ class RClient(WechatSogouBase):
         }
         params.update(self.base_params)
         files = {'image': ('a.jpg', im)}
-        r = requests.post('http://api.ruokuai.com/create.json', data=params, files=files, headers=self.headers)
+        # 打码平台最多等待timeout秒返回结果
+        r = requests.post('http://api.ruokuai.com/create.json', data=params, files=files, headers=self.headers,
+                          timeout=(config.connect_timeout, timeout + config.read_timeout))
         return r.json()
 
     def report_error(self, im_id):
@@ -46,5 +49,6 @@ class RClient(WechatSogouBase):
             'id': im_id,
         }
         params.update(self.base_params)
-        r = requests.post('http://api.ruokuai.com/reporterror.json', data=params, headers=self.headers)
+        r = requests.post('http://api.ruokuai.com/reporterror.json', data=params, headers=self.headers,
+                          timeout=(config.connect_timeout, config.read_timeout))
         return r.json()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""抓取worker
+
+可以同时启动多个进程，或者在多台共享数据目录的机器上运行(这时config.sqlite_wal必须为False，WAL模式只能在一台机器上使用)。每个worker从wxid表中领取一批微信号，用自己的会话、代理和请求预算抓取，
+完成后释放并记录抓取时间。worker退出或崩溃时，没有续约的微信号在config.wxid_lease秒后可以被其他worker领取。
+
+    python worker.py --id worker-1 --proxy http://10.0.0.2:3128
+"""
+from __future__ import print_function
+
+import argparse
+import socket
+import threading
+import time
+
+import config
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Weixin-Article-Spider crawl worker')
+    parser.add_argument('--id', default=socket.gethostname(),
+                        help='worker id，同一台机器上启动多个worker时必须不同，重启后用同一个id可以恢复没有完成的抓取')
+    parser.add_argument('--batch', type=int, default=config.worker_batch_size, help='每次领取的微信号数量')
+    parser.add_argument('--proxy', default=None, help='这个worker使用的代理')
+    return parser.parse_args()
+
+
+class LeaseKeeper(threading.Thread):
+    """抓取期间定期为领取的微信号续约
+    """
+
+    def __init__(self, owner, names):
+        super(LeaseKeeper, self).__init__()
+        self.daemon = True
+        self.owner = owner
+        self.names = names
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from storage.sqlite_storage import SQLiteStorage
+        db_helper = SQLiteStorage()
+        while not self._stop_event.wait(config.wxid_lease / 3.0):
+            db_helper.renew_wxid_lease(self.owner, self.names, config.wxid_lease)
+        db_helper.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def main():
+    args = _parse_args()
+    # 每个worker用自己的搜狗会话和代理，必须在导入common.download_queue之前设置
+    config.cache_session_name = '%s_%s' % (config.cache_session_name, args.id)
+    if args.proxy:
+        config.proxies = {'http': args.proxy, 'https': args.proxy}
+
+    from common.download_queue import SpiderThread
+    from storage.sqlite_storage import SQLiteStorage
+
+    db_helper = SQLiteStorage()
+    run = db_helper.get_unfinished_run(args.id)
+    while True:
+        if run:
+            print('resume unfinished crawl #%s' % run['id'])
+            db_helper.release_jobs(run['id'])
+            run_id = run['id']
+            # lease过期后被其他worker领取的微信号不再抓取
+            names = db_helper.renew_wxid_lease(args.id, run['wxid_list'], config.wxid_lease)
+            lost = [n for n in run['wxid_list'] if n not in names]
+            if lost:
+                print('lease of %s taken by other workers' % ', '.join(lost))
+            if not names:
+                # 结束这次抓取，没有下载的任务由领取了微信号的worker放回它的抓取(见SQLiteStorage.enqueue_jobs)
+                db_helper.finish_run(run_id)
+            run = None
+        else:
+            names, run_id = db_helper.claim_wxids(args.id, args.batch, config.wxid_lease,
+                                                  config.worker_recrawl_interval), None
+        if not names:
+            time.sleep(config.worker_idle_sleep)
+            continue
+        print('worker %s claimed %s' % (args.id, ', '.join(names)))
+        thread = SpiderThread([{'name': n} for n in names], run_id=run_id, owner=args.id)
+        keeper = LeaseKeeper(args.id, names)
+        keeper.start()
+        thread.start()
+        try:
+            while thread.is_alive():
+                thread.join(1)
+        except KeyboardInterrupt:
+            thread.stop()
+            thread.join()
+            keeper.stop()
+            db_helper.release_wxids(args.id, names, crawled=False)
+            break
+        keeper.stop()
+        # 超过截止时间或出错没有完成的抓取只释放，下次启动时恢复，或由其他worker重新领取
+        db_helper.release_wxids(args.id, names, crawled=thread.finished)
+
+
+if __name__ == '__main__':
+    main()